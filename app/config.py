@@ -2,42 +2,168 @@
 Конфигурация приложения
 """
 import os
-from datetime import timedelta
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import FrozenSet, Tuple
 from dotenv import load_dotenv
 
 # Загружаем переменные окружения из .env файла
 load_dotenv()
 
-# Настройки JWT
-SECRET_KEY = os.getenv("SECRET_KEY")
-if not SECRET_KEY:
-    raise ValueError("Отсутствует SECRET_KEY в .env файле")
+@dataclass(frozen=True)
+class Settings:
+    """
+    Настройки приложения. Значения из окружения читаются один раз при импорте,
+    дальше используется только неизменяемый объект settings.
+    """
+    # Значения из .env
+    SECRET_KEY: str
+    MONGODB_URL: str
 
-ALGORITHM = "HS256"
-ACCESS_TOKEN_EXPIRE_MINUTES = 30
-REFRESH_TOKEN_EXPIRE_DAYS = 7
+    # Настройки JWT
+    ALGORITHM: str = "HS256"
+    # Данные пользователя в токене доступа обновляются не реже этого срока
+    ACCESS_TOKEN_EXPIRE_MINUTES: int = 15
+    REFRESH_TOKEN_EXPIRE_DAYS: int = 7
 
-# Настройки MongoDB
-MONGODB_URL = os.getenv("MONGODB_URL")
-if not MONGODB_URL:
-    raise ValueError("Отсутствует MONGODB_URL в .env файле")
+    # Настройки MongoDB
+    DB_NAME: str = "ocr_db"
+    MONGODB_MAX_POOL_SIZE: int = 50
+    MONGODB_MIN_POOL_SIZE: int = 10
+    MONGODB_MAX_IDLE_TIME_MS: int = 60000
+    MONGODB_SERVER_SELECTION_TIMEOUT_MS: int = 5000
+    # Сжатие трафика MongoDB. zlib встроен в Python; для "zstd" и "snappy"
+    # нужны пакеты zstandard и python-snappy (без них pymongo выдает
+    # предупреждение и пропускает компрессор)
+    MONGODB_COMPRESSORS: str = "zlib"
 
-DB_NAME = "ocr_db"
+    # Redis для счетчиков лимита запросов (пустая строка - счетчики в MongoDB)
+    REDIS_URL: str = ""
+    # Время жизни результатов распознавания в кэше Redis (секунды)
+    OCR_RESULT_CACHE_TTL: int = 86400
 
-# Лимиты для обычных пользователей
-STANDARD_USER_DAILY_REQUEST_LIMIT = 10
-STANDARD_USER_HISTORY_LIMIT = 30
+    # Время жизни кэша системных настроек (секунды)
+    SYSTEM_SETTINGS_CACHE_TTL: int = 60
 
-# CORS настройки
-CORS_ORIGINS = [
-    "http://localhost:3000",  # Адрес React приложения
-]
+    # Кэш успешных проверок пароля: время жизни (секунды) и размер
+    PASSWORD_VERIFY_CACHE_TTL: int = 60
+    PASSWORD_VERIFY_CACHE_SIZE: int = 4096
 
-# Настройки приложения
-APP_TITLE = "OCR API"
-APP_DESCRIPTION = "API для распознавания текста с изображений"
-APP_VERSION = "1.0.0"
+    # Размер кэша проверенных токенов доступа
+    TOKEN_CACHE_SIZE: int = 10000
 
-# Настройки изображений
-ALLOWED_IMAGE_FORMATS = ["image/png", "image/jpeg", "image/jpg"]
-DEFAULT_OCR_LANGUAGES = ['en', 'ru']
\ No newline at end of file
+    # Лимиты для обычных пользователей
+    STANDARD_USER_DAILY_REQUEST_LIMIT: int = 10
+    STANDARD_USER_HISTORY_LIMIT: int = 30
+
+    # CORS настройки
+    CORS_ORIGINS: Tuple[str, ...] = (
+        "http://localhost:3000",  # Адрес React приложения
+    )
+
+    # Настройки приложения
+    APP_TITLE: str = "OCR API"
+    APP_DESCRIPTION: str = "API для распознавания текста с изображений"
+    APP_VERSION: str = "1.0.0"
+
+    # Настройки изображений
+    ALLOWED_IMAGE_FORMATS: FrozenSet[str] = frozenset({"image/png", "image/jpeg", "image/jpg"})
+    DEFAULT_OCR_LANGUAGES: Tuple[str, ...] = ('en', 'ru')
+    # Максимальное число пикселей декодируемого изображения
+    MAX_IMAGE_PIXELS: int = 50_000_000
+
+    # Сколько ридеров EasyOCR (наборов языков) держать в памяти одновременно
+    OCR_READER_CACHE_SIZE: int = 3
+    # Количество процессов для распознавания (0 - распознавание в текущем процессе)
+    OCR_PROCESS_WORKERS: int = 0
+    # Количество потоков распознавания в текущем процессе
+    # (0 - по числу GPU, без GPU - половина ядер CPU)
+    OCR_THREAD_WORKERS: int = 0
+    # Пакетное распознавание одновременных запросов: максимальный размер
+    # пакета (1 - без объединения) и время ожидания его заполнения (мс)
+    OCR_BATCH_SIZE: int = 1
+    OCR_BATCH_WINDOW_MS: int = 20
+    # Распознавание строк на GPU в половинной точности (на CPU и GPU старше
+    # Volta не используется; детектор всегда работает в FP32).
+    # Выключено по умолчанию: включать после проверки на своем GPU
+    OCR_USE_FP16: bool = False
+    # Тип половинной точности: "float16" или "bfloat16" (только Ampere и
+    # новее, на более старых GPU используется float16). Выход модели
+    # в любом случае возвращается в float32
+    OCR_HALF_DTYPE: str = "float16"
+    # Подбор алгоритмов cuDNN под размер входа (выгоден, если размеры
+    # изображений повторяются; каждый новый размер требует замеров)
+    OCR_CUDNN_BENCHMARK: bool = False
+    # Компиляция модели распознавания строк через torch.compile
+    # (ускоряет повторные вызовы, но удлиняет запуск и первые запросы)
+    OCR_TORCH_COMPILE: bool = False
+    # Декодирование изображений в оттенки серого вместо RGB
+    OCR_GRAYSCALE: bool = True
+    # Предобработка пропускается для качественных изображений: контраст -
+    # при стандартном отклонении яркости выше порога, резкость - при
+    # дисперсии лапласиана выше порога (оценка по каждому 8-му пикселю)
+    OCR_SKIP_CONTRAST_STD: float = 60.0
+    OCR_SKIP_SHARPEN_LAPLACIAN_VAR: float = 500.0
+
+def _env_int(name: str, default: int) -> int:
+    """
+    Целое значение из окружения или значение по умолчанию
+    """
+    value = os.getenv(name)
+    if not value:
+        return default
+    try:
+        return int(value)
+    except ValueError:
+        raise ValueError(f"Переменная окружения {name} должна быть целым числом")
+
+def _env_bool(name: str, default: bool) -> bool:
+    """
+    Логическое значение из окружения (1/true/yes/on или 0/false/no/off)
+    или значение по умолчанию
+    """
+    value = os.getenv(name)
+    if not value:
+        return default
+    value = value.strip().lower()
+    if value in ("1", "true", "yes", "on"):
+        return True
+    if value in ("0", "false", "no", "off"):
+        return False
+    raise ValueError(f"Переменная окружения {name} должна быть логическим значением (true/false)")
+
+@lru_cache(maxsize=1)
+def get_settings() -> Settings:
+    """
+    Получить настройки приложения (создаются один раз)
+    """
+    secret_key = os.getenv("SECRET_KEY")
+    if not secret_key:
+        raise ValueError("Отсутствует SECRET_KEY в .env файле")
+
+    mongodb_url = os.getenv("MONGODB_URL")
+    if not mongodb_url:
+        raise ValueError("Отсутствует MONGODB_URL в .env файле")
+
+    ocr_half_dtype = os.getenv("OCR_HALF_DTYPE", Settings.OCR_HALF_DTYPE)
+    if ocr_half_dtype not in ("float16", "bfloat16"):
+        raise ValueError("Переменная окружения OCR_HALF_DTYPE должна быть float16 или bfloat16")
+
+    return Settings(
+        SECRET_KEY=secret_key,
+        MONGODB_URL=mongodb_url,
+        REDIS_URL=os.getenv("REDIS_URL", ""),
+        MONGODB_COMPRESSORS=os.getenv("MONGODB_COMPRESSORS", Settings.MONGODB_COMPRESSORS),
+        MONGODB_MAX_POOL_SIZE=_env_int("MONGODB_MAX_POOL_SIZE", Settings.MONGODB_MAX_POOL_SIZE),
+        MONGODB_MIN_POOL_SIZE=_env_int("MONGODB_MIN_POOL_SIZE", Settings.MONGODB_MIN_POOL_SIZE),
+        OCR_PROCESS_WORKERS=_env_int("OCR_PROCESS_WORKERS", Settings.OCR_PROCESS_WORKERS),
+        OCR_THREAD_WORKERS=_env_int("OCR_THREAD_WORKERS", Settings.OCR_THREAD_WORKERS),
+        OCR_BATCH_SIZE=_env_int("OCR_BATCH_SIZE", Settings.OCR_BATCH_SIZE),
+        OCR_USE_FP16=_env_bool("OCR_USE_FP16", Settings.OCR_USE_FP16),
+        OCR_HALF_DTYPE=ocr_half_dtype,
+        OCR_CUDNN_BENCHMARK=_env_bool("OCR_CUDNN_BENCHMARK", Settings.OCR_CUDNN_BENCHMARK),
+        OCR_TORCH_COMPILE=_env_bool("OCR_TORCH_COMPILE", Settings.OCR_TORCH_COMPILE),
+        OCR_GRAYSCALE=_env_bool("OCR_GRAYSCALE", Settings.OCR_GRAYSCALE)
+    )
+
+settings = get_settings()
\ No newline at end of file
@@ -1,32 +1,73 @@
 """
 Настройка подключения к базе данных
 """
+import asyncio
 from motor.motor_asyncio import AsyncIOMotorClient
-from app.config import MONGODB_URL, DB_NAME
+from pymongo import IndexModel
+import redis.asyncio as aioredis
+from app.config import settings
 
 # MongoDB клиент
 mongodb_client = None
 db = None
 
+# Redis клиент (None, если REDIS_URL не задан)
+redis_client = None
+
 async def connect_to_mongodb():
     """
     Подключение к MongoDB
     """
     global mongodb_client, db
     
-    print(f"Подключение к MongoDB по URL: {MONGODB_URL}")
+    print(f"Подключение к MongoDB по URL: {settings.MONGODB_URL}")
     try:
-        mongodb_client = AsyncIOMotorClient(MONGODB_URL)
+        # Размер пула задаем явно: админские запросы выполняются параллельно
+        # через asyncio.gather и занимают несколько соединений одновременно
+        mongodb_client = AsyncIOMotorClient(
+            settings.MONGODB_URL,
+            maxPoolSize=settings.MONGODB_MAX_POOL_SIZE,
+            minPoolSize=settings.MONGODB_MIN_POOL_SIZE,
+            maxIdleTimeMS=settings.MONGODB_MAX_IDLE_TIME_MS,
+            serverSelectionTimeoutMS=settings.MONGODB_SERVER_SELECTION_TIMEOUT_MS,
+            compressors=settings.MONGODB_COMPRESSORS
+        )
         # Проверка соединения
         await mongodb_client.admin.command('ping')
         print("Успешно подключено к MongoDB")
-        db = mongodb_client[DB_NAME]
+        db = mongodb_client[settings.DB_NAME]
         
-        # Создаем индексы для коллекций
-        await db.users.create_index("email", unique=True)
-        await db.users.create_index("username", unique=True)
-        await db.refresh_tokens.create_index("token", unique=True)
+        # Прогрев пула: параллельные ping открывают соединения заранее,
+        # чтобы первые запросы не тратили время на TCP/TLS и аутентификацию
+        await asyncio.gather(*[
+            db.command("ping") for _ in range(settings.MONGODB_MIN_POOL_SIZE)
+        ])
         
+        # Создаем индексы: одна команда createIndexes на коллекцию,
+        # коллекции обрабатываются параллельно
+        await asyncio.gather(
+            db.users.create_indexes([
+                IndexModel("email", unique=True),
+                IndexModel("username", unique=True),
+                # Топ пользователей по количеству запросов в статистике
+                IndexModel([("request_count", -1)])
+            ]),
+            db.refresh_tokens.create_indexes([
+                # sparse: токены, выданные до хеширования, получают token_hash при запуске
+                IndexModel("token_hash", unique=True, sparse=True),
+                IndexModel("user_id"),
+                # Истекшие refresh-токены удаляются самой MongoDB
+                IndexModel("expires_at", expireAfterSeconds=0)
+            ]),
+            # Индексы для запросов OCR: фильтры по дате, пользователю и языку
+            # в статистике, лимитах и истории запросов
+            db.ocr_requests.create_indexes([
+                IndexModel([("created_at", -1)]),
+                IndexModel([("user_id", 1), ("created_at", -1)]),
+                IndexModel([("language", 1), ("created_at", -1)])
+            ])
+        )
+
         return db
     except Exception as e:
         print(f"Ошибка при подключении к MongoDB: {str(e)}")
@@ -45,4 +86,38 @@ def get_database():
     """
     Получить объект базы данных
     """
-    return db
\ No newline at end of file
+    return db
+
+async def connect_to_redis():
+    """
+    Подключение к Redis, если задан REDIS_URL
+    """
+    global redis_client
+    
+    if not settings.REDIS_URL:
+        return None
+    
+    try:
+        redis_client = aioredis.from_url(settings.REDIS_URL, decode_responses=True)
+        await redis_client.ping()
+        print("Успешно подключено к Redis")
+        return redis_client
+    except Exception as e:
+        print(f"Ошибка при подключении к Redis: {str(e)}")
+        raise e
+
+async def close_redis_connection():
+    """
+    Закрытие соединения с Redis
+    """
+    global redis_client
+    if redis_client:
+        await redis_client.aclose()
+        redis_client = None
+        print("Соединение с Redis закрыто")
+
+def get_redis():
+    """
+    Получить клиент Redis (None, если Redis не используется)
+    """
+    return redis_client
@@ -1,16 +1,55 @@
 """
 Зависимости FastAPI
 """
-from fastapi import Depends
-from app.utils.security import get_current_user, get_current_active_user, get_current_admin
+from typing import Any, AsyncIterator, Dict
+
+from fastapi import Depends, HTTPException, status
+from app.utils.security import get_current_user, get_current_active_user, get_current_user_document, get_current_admin
 from app.database import get_database
 from app.utils.image import get_ocr_reader
+from app.models.admin import SystemSettings
+from app.services.admin import get_system_settings
+from app.services.ocr import check_user_request_limit, release_user_request
 
 # Экспортируем зависимости для использования в маршрутах
 __all__ = [
     "get_current_user",
     "get_current_active_user",
+    "get_current_user_document",
     "get_current_admin",
     "get_database",
-    "get_ocr_reader"
-]
\ No newline at end of file
+    "get_ocr_reader",
+    "check_maintenance_mode",
+    "check_access"
+]
+
+async def check_maintenance_mode(
+    current_user: Dict[str, Any] = Depends(get_current_active_user),
+    system_settings: SystemSettings = Depends(get_system_settings)
+) -> SystemSettings:
+    """
+    Проверка режима обслуживания (администраторам доступ сохраняется)
+    """
+    if system_settings.maintenance_mode and not current_user.get("is_admin", False):
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Сервис временно недоступен: проводятся технические работы"
+        )
+    return system_settings
+
+async def check_access(
+    current_user: Dict[str, Any] = Depends(get_current_active_user),
+    system_settings: SystemSettings = Depends(check_maintenance_mode)
+) -> AsyncIterator[Dict[str, Any]]:
+    """
+    Проверка доступа к распознаванию до обращения к OCR: режим обслуживания
+    и дневной лимит запросов. Запрос резервируется в лимите сразу; если
+    обработка завершилась ошибкой (неподдерживаемый формат, слишком большой
+    файл, ошибка распознавания), резерв возвращается.
+    """
+    reservation = await check_user_request_limit(current_user, system_settings.request_limit)
+    try:
+        yield current_user
+    except Exception:
+        await release_user_request(current_user, reservation)
+        raise
@@ -1,27 +1,92 @@
 """
 Основной файл приложения FastAPI
 """
+import asyncio
+import logging
+from contextlib import asynccontextmanager
+
+import orjson
 import uvicorn
 from fastapi import FastAPI, Request
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import ORJSONResponse, Response
 
-from app.config import CORS_ORIGINS, APP_TITLE, APP_DESCRIPTION, APP_VERSION
-from app.database import connect_to_mongodb, close_mongodb_connection
-from app.utils.image import init_ocr_reader
+from app.config import settings
+from app.middleware import UploadSizeLimitMiddleware
+from app.database import connect_to_mongodb, close_mongodb_connection, connect_to_redis, close_redis_connection
+from app.services.auth import migrate_refresh_tokens
+from app.services.ocr import backfill_stats_counters
+from app.services.ocr_writer import start_ocr_writer, stop_ocr_writer
+from app.services.user import backfill_request_counts
+from app.models.ocr import LANG_CODES
+from app.utils.image import init_ocr_readers, init_ocr_pool, shutdown_ocr_pool, start_ocr_executor, stop_batch_workers
 from app.routers import router
 
+logger = logging.getLogger(__name__)
+
+# Тело ответа для необработанных ошибок сериализуется один раз
+_INTERNAL_ERROR_BODY = orjson.dumps({"detail": "Внутренняя ошибка сервера"})
+
+def init_ocr():
+    """
+    Инициализация EasyOCR: либо пул процессов со своими ридерами,
+    либо ридеры в текущем процессе (для всех поддерживаемых наборов языков)
+    """
+    start_ocr_executor()
+    if settings.OCR_PROCESS_WORKERS > 0:
+        init_ocr_pool(LANG_CODES.values())
+    else:
+        init_ocr_readers(LANG_CODES.values())
+
+async def init_database():
+    """
+    Подключение к MongoDB и Redis и подготовка данных
+    """
+    await asyncio.gather(connect_to_mongodb(), connect_to_redis())
+    await asyncio.gather(backfill_request_counts(), backfill_stats_counters(), migrate_refresh_tokens())
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """
+    Действия при запуске и остановке приложения
+    """
+    # Подключение к MongoDB и загрузка моделей EasyOCR независимы,
+    # поэтому выполняются одновременно
+    await asyncio.gather(
+        init_database(),
+        run_in_threadpool(init_ocr)
+    )
+    start_ocr_writer()
+    
+    yield
+    
+    # Накопленные запросы OCR записываются до закрытия соединения
+    await stop_ocr_writer()
+    await close_mongodb_connection()
+    await close_redis_connection()
+    # Остановка пулов ждет завершения текущих распознаваний,
+    # поэтому выполняется вне цикла событий
+    stop_batch_workers()
+    await run_in_threadpool(shutdown_ocr_pool)
+
 # Инициализация FastAPI
 app = FastAPI(
-    title=APP_TITLE,
-    description=APP_DESCRIPTION,
-    version=APP_VERSION
+    title=settings.APP_TITLE,
+    description=settings.APP_DESCRIPTION,
+    version=settings.APP_VERSION,
+    default_response_class=ORJSONResponse,
+    lifespan=lifespan
 )
 
+# Ограничение размера загружаемых изображений до разбора формы
+# (добавляется раньше CORS, чтобы ответы 413 получали CORS-заголовки)
+app.add_middleware(UploadSizeLimitMiddleware, paths=["/extract-text"])
+
 # Настройка CORS
 app.add_middleware(
     CORSMiddleware,
-    allow_origins=CORS_ORIGINS,
+    allow_origins=settings.CORS_ORIGINS,
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
@@ -30,24 +95,6 @@ app.add_middleware(
 # Подключение маршрутов
 app.include_router(router)
 
-@app.on_event("startup")
-async def startup():
-    """
-    Действия при запуске приложения
-    """
-    # Подключение к MongoDB
-    await connect_to_mongodb()
-    
-    # Инициализация EasyOCR
-    init_ocr_reader()
-
-@app.on_event("shutdown")
-async def shutdown():
-    """
-    Действия при остановке приложения
-    """
-    await close_mongodb_connection()
-
 @app.get("/")
 async def root():
     """
@@ -62,11 +109,14 @@ async def root():
 @app.exception_handler(Exception)
 async def global_exception_handler(request: Request, exc: Exception):
     """
-    Глобальный обработчик исключений
+    Глобальный обработчик исключений.
+    Подробности ошибки пишутся в лог, клиенту возвращается общий ответ.
     """
-    return JSONResponse(
+    logger.exception("Необработанная ошибка при запросе %s %s", request.method, request.url.path, exc_info=exc)
+    return Response(
+        content=_INTERNAL_ERROR_BODY,
         status_code=500,
-        content={"detail": f"Внутренняя ошибка сервера: {str(exc)}"}
+        media_type="application/json"
     )
 
 if __name__ == "__main__":
@@ -0,0 +1,59 @@
+"""
+ASGI middleware приложения
+"""
+from typing import Iterable
+
+from fastapi import HTTPException, status
+from fastapi.responses import ORJSONResponse
+
+from app.services.admin import get_system_settings
+
+# Запас на границы multipart и служебные поля формы сверх размера самого файла
+MULTIPART_OVERHEAD = 64 * 1024
+
+class UploadSizeLimitMiddleware:
+    """
+    Ограничение размера тела запроса для эндпоинтов загрузки изображений.
+    Starlette сохраняет multipart-форму целиком до вызова обработчика,
+    поэтому слишком большой запрос прерывается здесь: по заголовку
+    Content-Length сразу, а без него - как только полученные части тела
+    превысят лимит.
+    """
+    def __init__(self, app, paths: Iterable[str]):
+        self.app = app
+        self.paths = frozenset(paths)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] not in self.paths:
+            await self.app(scope, receive, send)
+            return
+        
+        system_settings = await get_system_settings()
+        max_body_size = system_settings.max_file_size * 1024 * 1024 + MULTIPART_OVERHEAD
+        detail = f"Размер файла превышает {system_settings.max_file_size} МБ"
+        
+        for name, value in scope["headers"]:
+            if name == b"content-length" and value.isdigit() and int(value) > max_body_size:
+                response = ORJSONResponse(
+                    {"detail": detail},
+                    status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE
+                )
+                await response(scope, receive, send)
+                return
+        
+        received = 0
+        
+        async def limited_receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > max_body_size:
+                    # HTTPException при разборе тела FastAPI пробрасывает как есть
+                    raise HTTPException(
+                        status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+                        detail=detail
+                    )
+            return message
+        
+        await self.app(scope, limited_receive, send)
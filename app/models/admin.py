@@ -23,4 +23,16 @@ class SystemSettings(BaseModel):
     preprocess_by_default: bool
     admin_email: str
     maintenance_mode: bool
-    max_file_size: int
\ No newline at end of file
+    max_file_size: int
+
+class UsersList(BaseModel):
+    """Модель списка пользователей с пагинацией"""
+    users: List[UserStats]
+    total: int
+    page: int
+    limit: int
+    total_pages: int
+
+class DetailMessage(BaseModel):
+    """Модель ответа с текстовым сообщением"""
+    detail: str
\ No newline at end of file
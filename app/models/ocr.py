@@ -2,7 +2,7 @@
 Модели связанные с OCR
 """
 from enum import Enum
-from typing import List, Optional, Dict, Any
+from typing import List, Optional, Dict, Any, Tuple
 from pydantic import BaseModel
 from datetime import datetime
 
@@ -13,6 +13,19 @@ class LanguageType(str, Enum):
     ru_en = "ru+en"
     en_ru = "en+ru"
 
+# Коды языков EasyOCR для каждого варианта (вычисляются один раз при импорте)
+LANG_CODES: Dict[LanguageType, Tuple[str, ...]] = {
+    LanguageType.ru: ('ru',),
+    LanguageType.en: ('en',),
+    LanguageType.ru_en: ('ru', 'en'),
+    LanguageType.en_ru: ('en', 'ru')
+}
+
+# Значение model_used в ответе для каждого варианта
+MODEL_USED: Dict[LanguageType, str] = {
+    language: f"EasyOCR ({','.join(codes)})" for language, codes in LANG_CODES.items()
+}
+
 class OcrResultRegion(BaseModel):
     """Модель региона с распознанным текстом"""
     bbox: List[List[float]]
@@ -2,10 +2,20 @@
 Модели связанные с пользователями
 """
 from datetime import datetime
-from typing import Optional
-from pydantic import BaseModel, EmailStr, Field, field_validator, ConfigDict
+from pathlib import Path
+from typing import Any, FrozenSet, Optional
+from pydantic import BaseModel, EmailStr, Field, field_validator, ConfigDict, AliasChoices
 from bson import ObjectId
 
+# Распространенные пароли загружаются один раз при импорте,
+# проверка в валидаторе - поиск в frozenset
+_COMMON_PASSWORDS_FILE = Path(__file__).resolve().parent.parent / "data" / "common_passwords.txt"
+COMMON_PASSWORDS: FrozenSet[str] = frozenset(
+    line.strip().lower()
+    for line in _COMMON_PASSWORDS_FILE.read_text(encoding="utf-8").splitlines()
+    if line.strip()
+)
+
 class UserBase(BaseModel):
     """Базовая модель пользователя"""
     email: EmailStr
@@ -20,6 +30,8 @@ class UserCreate(UserBase):
     def password_strength(cls, v: str) -> str:
         if len(v) < 8:
             raise ValueError('Пароль должен содержать не менее 8 символов')
+        if v.lower() in COMMON_PASSWORDS:
+            raise ValueError('Пароль слишком распространен, выберите другой')
         return v
 
 class UserUpdate(BaseModel):
@@ -31,11 +43,7 @@ class UserUpdate(BaseModel):
 
 class UserInDB(UserBase):
     """Модель пользователя в базе данных"""
-    model_config = ConfigDict(
-        populate_by_name=True,
-        arbitrary_types_allowed=True,
-        json_encoders={ObjectId: str}
-    )
+    model_config = ConfigDict(populate_by_name=True)
     
     id: str = Field(default_factory=lambda: str(ObjectId()), alias="_id")
     is_active: bool = True
@@ -47,10 +55,18 @@ class UserOut(UserBase):
     """Модель пользователя для ответа API"""
     model_config = ConfigDict(from_attributes=True)
     
-    id: str
+    # Документ из MongoDB можно валидировать напрямую: _id попадает в id
+    id: str = Field(validation_alias=AliasChoices("id", "_id"))
     is_premium: bool
     is_admin: bool = False
     created_at: datetime
+    
+    @field_validator('id', mode='before')
+    @classmethod
+    def object_id_to_str(cls, v: Any) -> Any:
+        if isinstance(v, ObjectId):
+            return str(v)
+        return v
 
 # Административные модели для пользователей
 class AdminUserUpdate(BaseModel):
@@ -60,6 +76,16 @@ class AdminUserUpdate(BaseModel):
     is_premium: Optional[bool] = None
     is_admin: Optional[bool] = None
 
+class AdminUserInfo(BaseModel):
+    """Информация о пользователе после изменения администратором"""
+    id: str
+    username: str
+    email: str
+    created_at: datetime
+    is_premium: bool
+    is_admin: bool = False
+    is_active: bool = True
+
 class UserStats(BaseModel):
     """Статистика пользователя для админ-панели"""
     id: str
@@ -4,8 +4,8 @@
 from fastapi import APIRouter, Depends, Query, Path, HTTPException, status
 import math
 
-from app.models.admin import DashboardStats, SystemSettings
-from app.models.user import AdminUserUpdate
+from app.models.admin import DashboardStats, SystemSettings, UsersList, DetailMessage
+from app.models.user import AdminUserUpdate, AdminUserInfo
 from app.models.ocr import OcrStatistics
 from app.services.admin import get_dashboard_stats, get_system_settings, update_system_settings
 from app.services.user import get_users_list, admin_update_user, admin_delete_user
@@ -25,7 +25,7 @@ async def admin_dashboard(current_user: dict = Depends(get_current_admin)):
     """
     return await get_dashboard_stats()
 
-@router.get("/users")
+@router.get("/users", response_model=UsersList)
 async def admin_get_users(
     current_user: dict = Depends(get_current_admin),
     page: int = Query(1, ge=1),
@@ -36,7 +36,7 @@ async def admin_get_users(
     """
     return await get_users_list(page, limit)
 
-@router.put("/users/{user_id}")
+@router.put("/users/{user_id}", response_model=AdminUserInfo)
 async def admin_update_user_endpoint(
     user_id: str = Path(..., title="ID пользователя"),
     user_data: AdminUserUpdate = ...,
@@ -54,7 +54,7 @@ async def admin_update_user_endpoint(
     
     return await admin_update_user(user_id, user_data)
 
-@router.delete("/users/{user_id}")
+@router.delete("/users/{user_id}", response_model=DetailMessage)
 async def admin_delete_user_endpoint(
     user_id: str = Path(..., title="ID пользователя"),
     current_user: dict = Depends(get_current_admin)
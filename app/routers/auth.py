@@ -7,7 +7,7 @@ from fastapi.security import OAuth2PasswordRequestForm
 from app.models.user import UserCreate, UserOut
 from app.models.token import Token, RefreshTokenRequest
 from app.services.auth import register_user, login_user, refresh_access_token, logout
-from app.utils.security import get_current_active_user
+from app.utils.security import get_current_user_document
 
 router = APIRouter(tags=["Аутентификация"])
 
@@ -40,15 +40,8 @@ async def logout_user(request: RefreshTokenRequest):
     return await logout(request.refresh_token)
 
 @router.get("/users/me", response_model=UserOut)
-async def read_users_me(current_user: dict = Depends(get_current_active_user)):
+async def read_users_me(current_user: dict = Depends(get_current_user_document)):
     """
     Получение информации о текущем пользователе
     """
-    return UserOut(
-        id=str(current_user["_id"]),
-        email=current_user["email"],
-        username=current_user["username"],
-        is_premium=current_user["is_premium"],
-        is_admin=current_user.get("is_admin", False),
-        created_at=current_user["created_at"]
-    )
\ No newline at end of file
+    return UserOut.model_validate(current_user)
\ No newline at end of file
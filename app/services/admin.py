@@ -1,13 +1,26 @@
 """
 Сервисы для администрирования
 """
+import asyncio
+import time
 from datetime import datetime, timedelta
-from typing import Dict, Any
+from typing import Dict, Any, List, Optional, Tuple
 from bson import ObjectId
 
+from app.config import settings as app_settings
 from app.database import get_database
 from app.models.admin import DashboardStats, SystemSettings
 from app.models.user import UserStats
+from app.services.user import USER_STATS_PROJECTION
+
+# Кэш системных настроек: (настройки, момент загрузки по time.monotonic())
+_settings_cache: Optional[Tuple[SystemSettings, float]] = None
+
+def _facet_count(docs: List[Dict[str, Any]]) -> int:
+    """
+    Значение $count из ветки $facet (для пустой выборки ветка пустая)
+    """
+    return docs[0]["n"] if docs else 0
 
 async def get_dashboard_stats() -> DashboardStats:
     """
@@ -15,129 +28,169 @@ async def get_dashboard_stats() -> DashboardStats:
     """
     db = get_database()
     
-    # Общее количество пользователей
-    total_users = await db.users.count_documents({})
-    
-    # Количество премиум пользователей
-    premium_users = await db.users.count_documents({"is_premium": True})
-    
-    # Общее количество запросов
-    total_requests = await db.ocr_requests.count_documents({})
-    
-    # Количество запросов сегодня
     today = datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0)
-    requests_today = await db.ocr_requests.count_documents({"created_at": {"$gte": today}})
-    
-    # Последние зарегистрированные пользователи
-    recent_users_cursor = db.users.find().sort("created_at", -1).limit(10)
-    recent_users = []
-    
-    async for user in recent_users_cursor:
-        # Подсчет количества запросов для каждого пользователя
-        request_count = await db.ocr_requests.count_documents({"user_id": user["_id"]})
-        recent_users.append(UserStats(
-            id=str(user["_id"]),
-            username=user["username"],
-            email=user["email"],
-            created_at=user["created_at"],
-            is_premium=user["is_premium"],
-            is_admin=user.get("is_admin", False),
-            is_active=user.get("is_active", True),
-            request_count=request_count
-        ))
-    
-    # Количество запросов по дням (за последние 30 дней)
     thirty_days_ago = datetime.utcnow() - timedelta(days=30)
     
-    pipeline = [
+    # Статистика по пользователям одним запросом: общее количество,
+    # премиум-пользователи и последние зарегистрированные (количество
+    # запросов хранится в самом документе пользователя)
+    users_pipeline = [
         {
-            "$match": {
-                "created_at": {"$gte": thirty_days_ago}
+            "$facet": {
+                "total": [
+                    {"$count": "n"}
+                ],
+                "premium": [
+                    {"$match": {"is_premium": True}},
+                    {"$count": "n"}
+                ],
+                "recent": [
+                    {
+                        "$sort": {"created_at": -1}
+                    },
+                    {
+                        "$limit": 10
+                    },
+                    {
+                        "$project": USER_STATS_PROJECTION
+                    }
+                ]
             }
-        },
-        {
-            "$group": {
-                "_id": {
-                    "year": {"$year": "$created_at"},
-                    "month": {"$month": "$created_at"},
-                    "day": {"$dayOfMonth": "$created_at"}
-                },
-                "count": {"$sum": 1},
-                "date": {"$first": "$created_at"}
-            }
-        },
-        {
-            "$sort": {"date": 1}
         }
     ]
     
-    requests_by_day = []
-    async for doc in db.ocr_requests.aggregate(pipeline):
-        requests_by_day.append({
-            "date": doc["date"].isoformat(),
-            "count": doc["count"]
-        })
-    
-    # Распределение по языкам
-    pipeline = [
+    # Статистика по запросам OCR одним проходом по коллекции.
+    # Ветки $facet используют только три поля, остальные (в том числе
+    # result_text) отбрасываются сразу
+    requests_pipeline = [
         {
-            "$group": {
-                "_id": "$language",
-                "count": {"$sum": 1}
-            }
+            "$project": {"user_id": 1, "language": 1, "created_at": 1}
         },
         {
-            "$sort": {"count": -1}
+            "$facet": {
+                "total": [
+                    {"$count": "n"}
+                ],
+                "today": [
+                    {"$match": {"created_at": {"$gte": today}}},
+                    {"$count": "n"}
+                ],
+                # Количество запросов по дням (за последние 30 дней)
+                "by_day": [
+                    {
+                        "$match": {
+                            "created_at": {"$gte": thirty_days_ago}
+                        }
+                    },
+                    {
+                        "$group": {
+                            "_id": {
+                                "year": {"$year": "$created_at"},
+                                "month": {"$month": "$created_at"},
+                                "day": {"$dayOfMonth": "$created_at"}
+                            },
+                            "count": {"$sum": 1},
+                            "date": {"$first": "$created_at"}
+                        }
+                    },
+                    {
+                        "$sort": {"date": 1}
+                    }
+                ],
+                # Распределение по языкам
+                "by_language": [
+                    {
+                        "$group": {
+                            "_id": "$language",
+                            "count": {"$sum": 1}
+                        }
+                    },
+                    {
+                        "$sort": {"count": -1}
+                    }
+                ],
+                # Активность пользователей (топ-10): сначала подсчет,
+                # затем соединение с users только для десяти записей
+                "top_users": [
+                    {
+                        "$group": {
+                            "_id": "$user_id",
+                            "requests": {"$sum": 1}
+                        }
+                    },
+                    {
+                        "$sort": {"requests": -1}
+                    },
+                    {
+                        "$limit": 10
+                    },
+                    {
+                        # Форма let + $expr (localField вместе с pipeline -
+                        # только MongoDB 5.0+)
+                        "$lookup": {
+                            "from": "users",
+                            "let": {"user_id": "$_id"},
+                            "pipeline": [
+                                {"$match": {"$expr": {"$eq": ["$_id", "$$user_id"]}}},
+                                {"$project": {"username": 1}}
+                            ],
+                            "as": "user"
+                        }
+                    },
+                    {
+                        "$unwind": "$user"
+                    },
+                    {
+                        "$project": {"username": "$user.username", "requests": 1}
+                    }
+                ]
+            }
         }
     ]
     
-    language_distribution = []
-    async for doc in db.ocr_requests.aggregate(pipeline):
-        language_distribution.append({
-            "language": doc["_id"],
-            "count": doc["count"]
-        })
+    # Два независимых запроса выполняем параллельно
+    users_facet, requests_facet = await asyncio.gather(
+        db.users.aggregate(users_pipeline).to_list(length=None),
+        db.ocr_requests.aggregate(requests_pipeline).to_list(length=None)
+    )
+    users_facet = users_facet[0]
+    requests_facet = requests_facet[0]
     
-    # Активность пользователей (топ-10)
-    pipeline = [
-        {
-            "$lookup": {
-                "from": "users",
-                "localField": "user_id",
-                "foreignField": "_id",
-                "as": "user"
-            }
-        },
-        {
-            "$unwind": "$user"
-        },
-        {
-            "$group": {
-                "_id": "$user_id",
-                "username": {"$first": "$user.username"},
-                "requests": {"$sum": 1}
-            }
-        },
-        {
-            "$sort": {"requests": -1}
-        },
-        {
-            "$limit": 10
-        }
+    # Данные берутся из БД, поэтому повторная валидация не нужна
+    recent_users = [
+        UserStats.model_construct(
+            id=str(user["_id"]),
+            username=user["username"],
+            email=user["email"],
+            created_at=user["created_at"],
+            is_premium=user["is_premium"],
+            is_admin=user.get("is_admin", False),
+            is_active=user.get("is_active", True),
+            request_count=user.get("request_count", 0)
+        )
+        for user in users_facet["recent"]
     ]
     
-    user_activity = []
-    async for doc in db.ocr_requests.aggregate(pipeline):
-        user_activity.append({
-            "username": doc["username"],
-            "requests": doc["requests"]
-        })
+    requests_by_day = [
+        {"date": doc["date"].isoformat(), "count": doc["count"]}
+        for doc in requests_facet["by_day"]
+    ]
+    
+    language_distribution = [
+        {"language": doc["_id"], "count": doc["count"]}
+        for doc in requests_facet["by_language"]
+    ]
+    
+    user_activity = [
+        {"username": doc["username"], "requests": doc["requests"]}
+        for doc in requests_facet["top_users"]
+    ]
     
     return DashboardStats(
-        totalUsers=total_users,
-        premiumUsers=premium_users,
-        totalRequests=total_requests,
-        requestsToday=requests_today,
+        totalUsers=_facet_count(users_facet["total"]),
+        premiumUsers=_facet_count(users_facet["premium"]),
+        totalRequests=_facet_count(requests_facet["total"]),
+        requestsToday=_facet_count(requests_facet["today"]),
         recentUsers=recent_users,
         requestsByDay=requests_by_day,
         languageDistribution=language_distribution,
@@ -146,8 +199,16 @@ async def get_dashboard_stats() -> DashboardStats:
 
 async def get_system_settings() -> SystemSettings:
     """
-    Получение системных настроек
+    Получение системных настроек.
+    Настройки читаются на каждом запросе OCR, поэтому кэшируются в процессе;
+    другие воркеры увидят изменения не позже чем через SYSTEM_SETTINGS_CACHE_TTL.
     """
+    global _settings_cache
+    if _settings_cache is not None:
+        cached_settings, loaded_at = _settings_cache
+        if time.monotonic() - loaded_at < app_settings.SYSTEM_SETTINGS_CACHE_TTL:
+            return cached_settings
+    
     db = get_database()
     
     # Получаем настройки из коллекции settings или используем значения по умолчанию
@@ -156,7 +217,7 @@ async def get_system_settings() -> SystemSettings:
     if not settings:
         # Если настройки не найдены, используем значения по умолчанию
         default_settings = SystemSettings(
-            request_limit=10,
+            request_limit=app_settings.STANDARD_USER_DAILY_REQUEST_LIMIT,
             default_language="ru+en",
             preprocess_by_default=True,
             admin_email="admin@example.com",
@@ -167,27 +228,35 @@ async def get_system_settings() -> SystemSettings:
         # Создаем запись с настройками по умолчанию
         await db.settings.insert_one({
             "_id": "system_settings",
-            **default_settings.dict()
+            **default_settings.model_dump()
         })
         
+        _settings_cache = (default_settings, time.monotonic())
         return default_settings
     
     # Удаляем поле _id из результата
     settings.pop("_id", None)
     
-    return SystemSettings(**settings)
+    # Документ записан из модели SystemSettings, повторная валидация не нужна
+    system_settings = SystemSettings.model_construct(**settings)
+    _settings_cache = (system_settings, time.monotonic())
+    return system_settings
 
 async def update_system_settings(settings: SystemSettings) -> SystemSettings:
     """
     Обновление системных настроек
     """
+    global _settings_cache
     db = get_database()
     
     # Обновляем настройки в базе данных
     await db.settings.update_one(
         {"_id": "system_settings"},
-        {"$set": settings.dict()},
+        {"$set": settings.model_dump()},
         upsert=True
     )
     
+    # Обновляем кэш текущего процесса сразу после записи
+    _settings_cache = (settings, time.monotonic())
+    
     return settings
\ No newline at end of file
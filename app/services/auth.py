@@ -5,16 +5,22 @@ from datetime import datetime, timedelta
 from typing import Dict, Any
 
 from fastapi import HTTPException, status
+from fastapi.concurrency import run_in_threadpool
+from pymongo import UpdateOne
+from pymongo.errors import OperationFailure
 from app.database import get_database
 from app.utils.security import (
+    build_token_claims,
     create_access_token, 
     create_refresh_token,
+    hash_refresh_token,
+    USER_AUTH_PROJECTION,
     authenticate_user,
     get_password_hash
 )
 from app.models.user import UserCreate, UserOut
 from app.models.token import Token
-from app.config import ACCESS_TOKEN_EXPIRE_MINUTES
+from app.config import settings
 from bson import ObjectId
 
 async def register_user(user: UserCreate) -> UserOut:
@@ -24,7 +30,7 @@ async def register_user(user: UserCreate) -> UserOut:
     db = get_database()
     
     # Проверяем, существует ли пользователь с таким email
-    existing_email = await db.users.find_one({"email": user.email})
+    existing_email = await db.users.find_one({"email": user.email}, projection={"_id": 1})
     if existing_email:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST, 
@@ -32,7 +38,7 @@ async def register_user(user: UserCreate) -> UserOut:
         )
     
     # Проверяем, существует ли пользователь с таким именем
-    existing_username = await db.users.find_one({"username": user.username})
+    existing_username = await db.users.find_one({"username": user.username}, projection={"_id": 1})
     if existing_username:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST, 
@@ -40,7 +46,7 @@ async def register_user(user: UserCreate) -> UserOut:
         )
     
     # Создаем нового пользователя
-    hashed_password = get_password_hash(user.password)
+    hashed_password = await run_in_threadpool(get_password_hash, user.password)
     user_data = {
         "email": user.email,
         "username": user.username,
@@ -48,6 +54,7 @@ async def register_user(user: UserCreate) -> UserOut:
         "is_active": True,
         "is_premium": False,
         "is_admin": False,
+        "request_count": 0,
         "created_at": datetime.utcnow()
     }
     
@@ -55,14 +62,7 @@ async def register_user(user: UserCreate) -> UserOut:
     user_data["_id"] = result.inserted_id
     
     # Преобразуем в модель ответа
-    return UserOut(
-        id=str(user_data["_id"]),
-        email=user_data["email"],
-        username=user_data["username"],
-        is_premium=user_data["is_premium"],
-        is_admin=user_data["is_admin"],
-        created_at=user_data["created_at"]
-    )
+    return UserOut.model_validate(user_data)
 
 async def login_user(username: str, password: str) -> Token:
     """
@@ -78,8 +78,8 @@ async def login_user(username: str, password: str) -> Token:
     
     # Создаем access token
     access_token, access_token_expires = create_access_token(
-        data={"sub": user["username"]},
-        expires_delta=timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
+        data=build_token_claims(user),
+        expires_delta=timedelta(minutes=settings.ACCESS_TOKEN_EXPIRE_MINUTES)
     )
     
     # Создаем refresh token
@@ -98,12 +98,17 @@ async def refresh_access_token(refresh_token: str) -> Token:
     """
     db = get_database()
     
-    # Проверяем refresh token
-    token_doc = await db.refresh_tokens.find_one({
-        "token": refresh_token,
-        "revoked": False,
-        "expires_at": {"$gt": datetime.utcnow()}
-    })
+    # Проверяем и сразу отзываем refresh token одной атомарной операцией:
+    # из одновременных запросов с одним токеном успешен только первый
+    token_doc = await db.refresh_tokens.find_one_and_update(
+        {
+            "token_hash": hash_refresh_token(refresh_token),
+            "revoked": False,
+            "expires_at": {"$gt": datetime.utcnow()}
+        },
+        {"$set": {"revoked": True}},
+        projection={"user_id": 1}
+    )
     
     if not token_doc:
         raise HTTPException(
@@ -113,7 +118,7 @@ async def refresh_access_token(refresh_token: str) -> Token:
         )
     
     # Получаем пользователя
-    user = await db.users.find_one({"_id": token_doc["user_id"]})
+    user = await db.users.find_one({"_id": token_doc["user_id"]}, projection=USER_AUTH_PROJECTION)
     if not user or not user["is_active"]:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
@@ -123,19 +128,13 @@ async def refresh_access_token(refresh_token: str) -> Token:
     
     # Создаем новый access token
     access_token, access_token_expires = create_access_token(
-        data={"sub": user["username"]},
-        expires_delta=timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
+        data=build_token_claims(user),
+        expires_delta=timedelta(minutes=settings.ACCESS_TOKEN_EXPIRE_MINUTES)
     )
     
     # Создаем новый refresh token
     new_refresh_token, refresh_token_expires = await create_refresh_token(str(user["_id"]))
     
-    # Отзываем старый refresh token
-    await db.refresh_tokens.update_one(
-        {"_id": token_doc["_id"]},
-        {"$set": {"revoked": True}}
-    )
-    
     return Token(
         access_token=access_token,
         refresh_token=new_refresh_token,
@@ -151,8 +150,42 @@ async def logout(refresh_token: str) -> Dict[str, str]:
     
     # Находим и отзываем refresh token
     result = await db.refresh_tokens.update_one(
-        {"token": refresh_token, "revoked": False},
+        {"token_hash": hash_refresh_token(refresh_token), "revoked": False},
         {"$set": {"revoked": True}}
     )
     
-    return {"detail": "Успешный выход из системы"}
\ No newline at end of file
+    return {"detail": "Успешный выход из системы"}
+
+async def migrate_refresh_tokens() -> None:
+    """
+    Перевод refresh токенов, сохраненных в открытом виде, на хранение
+    хешей (выполняется при запуске). Выданные ранее токены продолжают работать.
+    """
+    db = get_database()
+    
+    # Уникальный индекс по открытому токену не позволит удалить это поле
+    # у нескольких документов, поэтому удаляется первым. Миграция выполняется
+    # в каждом процессе, и индекс может быть удален другим процессом
+    # между проверкой и удалением (IndexNotFound, код 27)
+    if "token_1" in await db.refresh_tokens.index_information():
+        try:
+            await db.refresh_tokens.drop_index("token_1")
+        except OperationFailure as e:
+            if e.code != 27:
+                raise
+    
+    legacy_tokens = await db.refresh_tokens.find(
+        {"token": {"$exists": True}},
+        projection={"token": 1}
+    ).to_list(length=None)
+    if not legacy_tokens:
+        return
+    
+    print("Хеширование сохраненных refresh токенов...")
+    await db.refresh_tokens.bulk_write([
+        UpdateOne(
+            {"_id": doc["_id"]},
+            {"$set": {"token_hash": hash_refresh_token(doc["token"])}, "$unset": {"token": ""}}
+        )
+        for doc in legacy_tokens
+    ], ordered=False)
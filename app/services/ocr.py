@@ -1,112 +1,231 @@
 """
 Сервисы для OCR функциональности
 """
-import io
+import asyncio
+import logging
 import math
 from datetime import datetime, timedelta
-from typing import Dict, Any, List
+from typing import Dict, Any, List, Optional
 from fastapi import HTTPException, status, UploadFile
-from PIL import Image
-import numpy as np
+from fastapi.concurrency import run_in_threadpool
 from bson import ObjectId
 
-from app.database import get_database
-from app.utils.image import preprocess_image, perform_ocr
-from app.models.ocr import LanguageType, OcrResult, OcrStatistics, OcrResultRegion
-from app.config import ALLOWED_IMAGE_FORMATS, STANDARD_USER_DAILY_REQUEST_LIMIT, STANDARD_USER_HISTORY_LIMIT
+from app.database import get_database, get_redis
+from app.services.admin import get_system_settings
+from app.services.ocr_writer import enqueue_ocr_request
+from app.services.ocr_cache import compute_cache_key, get_cached_result, cache_result
+from app.services.ratelimit import reserve_request, release_request
+from app.utils.image import run_ocr
+from app.models.ocr import LANG_CODES, MODEL_USED, LanguageType, OcrResult, OcrStatistics, OcrResultRegion, OcrRequestInfo
+from app.config import settings
 
-async def check_user_request_limit(user_id: str, is_premium: bool) -> None:
+logger = logging.getLogger(__name__)
+
+# Сообщение об ошибке формата файла не зависит от запроса
+_UNSUPPORTED_FORMAT_DETAIL = (
+    f"Неподдерживаемый формат файла. Поддерживаемые форматы: {', '.join(sorted(settings.ALLOWED_IMAGE_FORMATS))}"
+)
+
+def _utc_day(moment: datetime) -> str:
     """
-    Проверка лимита запросов для пользователя
+    Ключ суток (UTC) для дневного счетчика запросов
     """
-    if not is_premium:
-        db = get_database()
-        day_ago = datetime.utcnow() - timedelta(days=1)
-        
-        requests_count = await db.ocr_requests.count_documents({
-            "user_id": ObjectId(user_id),
-            "created_at": {"$gt": day_ago}
-        })
-        
-        if requests_count >= STANDARD_USER_DAILY_REQUEST_LIMIT:
-            raise HTTPException(
-                status_code=status.HTTP_429_TOO_MANY_REQUESTS,
-                detail="Превышен лимит запросов. Обновите аккаунт до Premium для снятия ограничений."
-            )
+    return moment.strftime("%Y-%m-%d")
+
+async def backfill_stats_counters() -> None:
+    """
+    Заполнение счетчиков статистики (ocr_stats_counters) по уже
+    сохраненным запросам (выполняется при запуске, если счетчиков еще нет)
+    """
+    db = get_database()
+    
+    if await db.ocr_stats_counters.find_one({}, projection={"_id": 1}) is not None:
+        return
+    if await db.ocr_requests.find_one({}, projection={"_id": 1}) is None:
+        return
+    
+    print("Заполнение счетчиков статистики запросов...")
+    merge = {
+        "$merge": {
+            "into": "ocr_stats_counters",
+            "on": "_id",
+            "whenMatched": "replace",
+            "whenNotMatched": "insert"
+        }
+    }
+    languages_pipeline = [
+        {
+            "$group": {
+                "_id": {"$concat": ["l:", "$language"]},
+                "count": {"$sum": 1}
+            }
+        },
+        merge
+    ]
+    days_pipeline = [
+        {
+            "$group": {
+                "_id": {"$dateToString": {"format": "%Y-%m-%d", "date": "$created_at"}},
+                "count": {"$sum": 1}
+            }
+        },
+        {
+            "$project": {
+                "_id": {"$concat": ["d:", "$_id"]},
+                "count": 1,
+                "date": {"$dateFromString": {"dateString": "$_id"}}
+            }
+        },
+        merge
+    ]
+    await asyncio.gather(
+        db.ocr_requests.aggregate(languages_pipeline).to_list(length=None),
+        db.ocr_requests.aggregate(days_pipeline).to_list(length=None)
+    )
+
+async def check_user_request_limit(user: Dict[str, Any], request_limit: int) -> Optional[str]:
+    """
+    Резервирование запроса в дневном лимите пользователя.
+    При настроенном Redis запрос учитывается в часовых счетчиках за последние
+    24 часа. Иначе используется счетчик из документа пользователя, который
+    сбрасывается в полночь UTC. Проверка и увеличение счетчика атомарны,
+    поэтому одновременные запросы не превышают лимит.
+    
+    Returns:
+        резерв для возврата через release_user_request, если запрос
+        не будет выполнен (None для премиум-пользователей)
+    """
+    if user.get("is_premium", False):
+        return None
+    
+    if get_redis() is not None:
+        reservation = await reserve_request(str(user["_id"]), request_limit)
+    else:
+        # Счетчик увеличивается только если лимит на сегодня не исчерпан
+        # (или если сутки сменились и счетчик начинается заново)
+        today = _utc_day(datetime.utcnow())
+        reserved = await get_database().users.find_one_and_update(
+            {
+                "_id": user["_id"],
+                "$or": [
+                    {"daily_request_date": {"$ne": today}},
+                    {"daily_request_count": {"$lt": request_limit}}
+                ]
+            },
+            [
+                {
+                    "$set": {
+                        "daily_request_count": {
+                            "$cond": [
+                                {"$eq": ["$daily_request_date", today]},
+                                {"$add": ["$daily_request_count", 1]},
+                                1
+                            ]
+                        },
+                        "daily_request_date": today
+                    }
+                }
+            ],
+            projection={"_id": 1}
+        )
+        reservation = today if reserved is not None else None
+    
+    if reservation is None:
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail="Превышен лимит запросов. Обновите аккаунт до Premium для снятия ограничений."
+        )
+    return reservation
+
+async def release_user_request(user: Dict[str, Any], reservation: Optional[str]) -> None:
+    """
+    Возврат резерва неудачного запроса (отклоненный файл, ошибка распознавания)
+    """
+    if reservation is None:
+        return
+    
+    if get_redis() is not None:
+        await release_request(reservation)
+    else:
+        await get_database().users.update_one(
+            {
+                "_id": user["_id"],
+                "daily_request_date": reservation,
+                "daily_request_count": {"$gt": 0}
+            },
+            {"$inc": {"daily_request_count": -1}}
+        )
 
 async def extract_text(
     file: UploadFile,
     language: LanguageType,
     preprocess: bool,
     detail: bool,
-    user_id: str,
-    is_premium: bool
+    user_id: str
 ) -> OcrResult:
     """
     Извлечение текста из изображения
     """
-    # Проверка лимита запросов
-    await check_user_request_limit(user_id, is_premium)
-    
-    # Проверка типа файла
+    # Проверка типа файла (до любых обращений к БД и чтения файла)
     content_type = file.content_type or ""
     
-    if content_type not in ALLOWED_IMAGE_FORMATS:
+    if content_type not in settings.ALLOWED_IMAGE_FORMATS:
         raise HTTPException(
             status_code=400, 
-            detail=f"Неподдерживаемый формат файла. Поддерживаемые форматы: {', '.join(ALLOWED_IMAGE_FORMATS)}"
+            detail=_UNSUPPORTED_FORMAT_DETAIL
+        )
+    
+    # Проверка размера файла (max_file_size задается в мегабайтах)
+    system_settings = await get_system_settings()
+    max_file_size = system_settings.max_file_size * 1024 * 1024
+    if file.size is not None and file.size > max_file_size:
+        raise HTTPException(
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            detail=f"Размер файла превышает {system_settings.max_file_size} МБ"
         )
     
     try:
-        # Чтение файла
-        content = await file.read()
-        image = Image.open(io.BytesIO(content)).convert("RGB")
-        
-        # Предобработка изображения при необходимости
-        if preprocess:
-            image = preprocess_image(image)
-        
-        # Преобразование в numpy array для EasyOCR
-        img_np = np.array(image)
-        
-        # Определение языков для распознавания
-        lang_map = {
-            LanguageType.ru: ['ru'],
-            LanguageType.en: ['en'],
-            LanguageType.ru_en: ['ru', 'en'],
-            LanguageType.en_ru: ['en', 'ru']
-        }
+        # Распознавание текста (декодирование, предобработка и OCR
+        # выполняются вне цикла событий)
+        languages = LANG_CODES[language]
+        # Файл уже сохранен в SpooledTemporaryFile, читаем из него напрямую
+        if get_redis() is not None:
+            # Повторно присланное изображение распознается из кэша
+            cache_key = await run_in_threadpool(compute_cache_key, file.file, languages, preprocess)
+            result = await get_cached_result(cache_key)
+            if result is None:
+                result = await run_ocr(file.file, languages, preprocess)
+                await cache_result(cache_key, result)
+        else:
+            result = await run_ocr(file.file, languages, preprocess)
         
-        # Распознавание текста
-        languages = lang_map.get(language, ['en', 'ru'])
-        result = perform_ocr(img_np, languages)
+        # Объединяем весь текст в один
+        full_text = " ".join([detection[1] for detection in result])
         
         # Формируем ответ
         if detail:
-            # Детальный ответ со всеми найденными текстовыми областями
-            text_regions = []
-            for detection in result:
-                bbox, text, confidence = detection
-                text_regions.append(OcrResultRegion(
-                    bbox=bbox,
+            # Детальный ответ со всеми найденными текстовыми областями.
+            # Типы приводятся здесь (EasyOCR возвращает числа numpy),
+            # поэтому повторная валидация каждой области не нужна
+            text_regions = [
+                OcrResultRegion.model_construct(
+                    bbox=[[float(x), float(y)] for x, y in bbox],
                     text=text,
                     confidence=float(confidence)
-                ))
-            
-            # Объединяем весь текст в один
-            full_text = " ".join([region.text for region in text_regions])
+                )
+                for bbox, text, confidence in result
+            ]
             
             response = OcrResult(
                 text=full_text,
                 regions=text_regions,
-                model_used=f"EasyOCR ({','.join(languages)})"
+                model_used=MODEL_USED[language]
             )
         else:
             # Простой ответ только с текстом
-            full_text = " ".join([detection[1] for detection in result])
             response = OcrResult(
                 text=full_text,
-                model_used=f"EasyOCR ({','.join(languages)})"
+                model_used=MODEL_USED[language]
             )
         
         # Сохраняем запрос в БД
@@ -120,26 +239,28 @@ async def extract_text(
         
         return response
         
-    except Exception as e:
-        if isinstance(e, HTTPException):
-            raise e
-        raise HTTPException(status_code=500, detail=f"Ошибка при обработке изображения: {str(e)}")
+    except HTTPException:
+        raise
+    except Exception:
+        # Подробности ошибки пишутся в лог, клиенту возвращается общий ответ
+        logger.exception("Ошибка при обработке изображения")
+        raise HTTPException(status_code=500, detail="Ошибка при обработке изображения")
 
 async def save_ocr_request(user_id: str, language: str, preprocess: bool, detail: bool, result_text: str) -> None:
     """
-    Сохранение запроса OCR в базу данных
+    Сохранение запроса OCR в базу данных.
+    Запрос записывается фоновой задачей пачками, она же обновляет счетчики
+    статистики и общий счетчик пользователя (дневной лимит уже учтен
+    при резервировании в check_user_request_limit).
     """
-    db = get_database()
-    ocr_request = {
+    await enqueue_ocr_request({
         "user_id": ObjectId(user_id),
         "language": language,
         "preprocess": preprocess,
         "detail": detail,
         "result_text": result_text,
         "created_at": datetime.utcnow()
-    }
-    
-    await db.ocr_requests.insert_one(ocr_request)
+    })
 
 async def get_user_ocr_history(user_id: str, is_premium: bool, limit: int = 30) -> List[Dict[str, Any]]:
     """
@@ -154,26 +275,26 @@ async def get_user_ocr_history(user_id: str, is_premium: bool, limit: int = 30)
     # Для премиум-пользователей нет ограничения на количество записей в истории
     # Для обычных пользователей возвращаем только последние записи
     if not is_premium:
-        limit = min(limit, STANDARD_USER_HISTORY_LIMIT)
+        limit = min(limit, settings.STANDARD_USER_HISTORY_LIMIT)
     
-    # Получаем записи из базы данных
+    # Получаем записи из базы данных (только нужные поля, одним пакетом)
     cursor = db.ocr_requests.find(
-        {"user_id": ObjectId(user_id)}
-    ).sort("created_at", -1).limit(limit)
+        {"user_id": ObjectId(user_id)},
+        projection={"language": 1, "preprocess": 1, "detail": 1, "result_text": 1, "created_at": 1}
+    ).sort("created_at", -1).limit(limit).batch_size(limit)
     
     # Преобразуем документы в список
-    result = []
-    async for doc in cursor:
-        result.append({
+    return [
+        {
             "id": str(doc["_id"]),
             "language": doc["language"],
             "preprocess": doc["preprocess"],
             "detail": doc["detail"],
             "result_text": doc["result_text"],
             "created_at": doc["created_at"].isoformat()
-        })
-    
-    return result
+        }
+        async for doc in cursor
+    ]
 
 async def get_ocr_statistics(
     page: int = 1, 
@@ -204,145 +325,112 @@ async def get_ocr_statistics(
     if language:
         filter_query["language"] = language
     
-    # Получение общей статистики
-    total_requests = await db.ocr_requests.count_documents({})
-    
-    # Количество запросов сегодня
     today = datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0)
-    requests_today = await db.ocr_requests.count_documents({"created_at": {"$gte": today}})
     
-    # Количество запросов по дням (за последние 30 дней)
+    # Статистика по дням, языкам и пользователям читается из счетчиков,
+    # которые обновляются при каждом запросе, а не агрегируется заново
     thirty_days_ago = datetime.utcnow() - timedelta(days=30)
-    
-    pipeline = [
-        {
-            "$match": {
-                "created_at": {"$gte": thirty_days_ago}
-            }
-        },
-        {
-            "$group": {
-                "_id": {
-                    "year": {"$year": "$created_at"},
-                    "month": {"$month": "$created_at"},
-                    "day": {"$dayOfMonth": "$created_at"}
-                },
-                "count": {"$sum": 1},
-                "date": {"$first": "$created_at"}
-            }
-        },
-        {
-            "$sort": {"date": 1}
-        }
-    ]
-    
-    requests_by_day = []
-    async for doc in db.ocr_requests.aggregate(pipeline):
-        requests_by_day.append({
-            "date": doc["date"].isoformat(),
-            "count": doc["count"]
-        })
+    by_day_cursor = db.ocr_stats_counters.find(
+        {"_id": {"$gte": f"d:{_utc_day(thirty_days_ago)}", "$lte": f"d:{_utc_day(datetime.utcnow())}"}}
+    ).sort("_id", 1)
     
     # Распределение по языкам
-    pipeline = [
-        {
-            "$group": {
-                "_id": "$language",
-                "count": {"$sum": 1}
-            }
-        },
-        {
-            "$sort": {"count": -1}
-        }
-    ]
+    by_language_cursor = db.ocr_stats_counters.find(
+        {"_id": {"$regex": "^l:"}}
+    ).sort("count", -1)
     
-    language_distribution = []
-    async for doc in db.ocr_requests.aggregate(pipeline):
-        language_distribution.append({
-            "language": doc["_id"],
-            "count": doc["count"]
-        })
+    # Топ пользователей по количеству запросов (счетчик хранится в документе пользователя)
+    top_users_cursor = db.users.find(
+        {"request_count": {"$gt": 0}},
+        projection={"username": 1, "request_count": 1}
+    ).sort("request_count", -1).limit(10)
     
-    # Топ пользователей по количеству запросов
+    # Пагинация для списка запросов
+    skip = (page - 1) * limit
+    
+    # Получение списка запросов с пользовательской информацией.
+    # Соединение с users выполняется только для записей текущей страницы
+    # (запросы удаленных пользователей удаляются вместе с ними)
     pipeline = [
         {
-            "$lookup": {
-                "from": "users",
-                "localField": "user_id",
-                "foreignField": "_id",
-                "as": "user"
-            }
-        },
-        {
-            "$unwind": "$user"
+            "$match": filter_query
         },
         {
-            "$group": {
-                "_id": "$user_id",
-                "username": {"$first": "$user.username"},
-                "count": {"$sum": 1}
-            }
+            "$sort": {"created_at": -1}
         },
         {
-            "$sort": {"count": -1}
+            "$skip": skip
         },
         {
-            "$limit": 10
-        }
-    ]
-    
-    top_users = []
-    async for doc in db.ocr_requests.aggregate(pipeline):
-        top_users.append({
-            "username": doc["username"],
-            "count": doc["count"]
-        })
-    
-    # Пагинация для списка запросов
-    skip = (page - 1) * limit
-    
-    # Получение списка запросов с пользовательской информацией
-    pipeline = [
-        {
-            "$match": filter_query
+            "$limit": limit
         },
         {
+            # Форма let + $expr (localField вместе с pipeline - только MongoDB 5.0+)
             "$lookup": {
                 "from": "users",
-                "localField": "user_id",
-                "foreignField": "_id",
+                "let": {"user_id": "$user_id"},
+                "pipeline": [
+                    {"$match": {"$expr": {"$eq": ["$_id", "$$user_id"]}}},
+                    {"$project": {"username": 1}}
+                ],
                 "as": "user"
             }
         },
         {
             "$unwind": "$user"
-        },
-        {
-            "$sort": {"created_at": -1}
-        },
-        {
-            "$skip": skip
-        },
-        {
-            "$limit": limit
         }
     ]
     
-    requests = []
-    async for doc in db.ocr_requests.aggregate(pipeline):
-        requests.append({
-            "id": str(doc["_id"]),
-            "user_id": str(doc["user_id"]),
-            "username": doc["user"]["username"],
-            "language": doc["language"],
-            "preprocess": doc["preprocess"],
-            "detail": doc["detail"],
-            "result_text": doc["result_text"],
-            "created_at": doc["created_at"]
-        })
+    # Все запросы независимы и выполняются параллельно. Общее количество
+    # запросов берется из метаданных коллекции (без обхода индекса),
+    # количество с учетом фильтров нужно для пагинации
+    (
+        total_requests,
+        requests_today,
+        by_day_docs,
+        by_language_docs,
+        top_users_docs,
+        request_docs,
+        total_filtered_requests
+    ) = await asyncio.gather(
+        db.ocr_requests.estimated_document_count(),
+        db.ocr_requests.count_documents({"created_at": {"$gte": today}}),
+        by_day_cursor.to_list(length=None),
+        by_language_cursor.to_list(length=None),
+        top_users_cursor.to_list(length=None),
+        db.ocr_requests.aggregate(pipeline).to_list(length=None),
+        db.ocr_requests.count_documents(filter_query)
+    )
+    
+    requests_by_day = [
+        {"date": doc["date"].isoformat(), "count": doc["count"]}
+        for doc in by_day_docs
+    ]
+    
+    language_distribution = [
+        {"language": doc["_id"][2:], "count": doc["count"]}
+        for doc in by_language_docs
+    ]
+    
+    top_users = [
+        {"username": doc["username"], "count": doc["request_count"]}
+        for doc in top_users_docs
+    ]
+    
+    requests = [
+        OcrRequestInfo.model_construct(
+            id=str(doc["_id"]),
+            user_id=str(doc["user_id"]),
+            username=doc["user"]["username"],
+            language=doc["language"],
+            preprocess=doc["preprocess"],
+            detail=doc["detail"],
+            result_text=doc["result_text"],
+            created_at=doc["created_at"]
+        )
+        for doc in request_docs
+    ]
     
-    # Общее количество запросов с учетом фильтров (для пагинации)
-    total_filtered_requests = await db.ocr_requests.count_documents(filter_query)
     total_pages = math.ceil(total_filtered_requests / limit)
     
     return OcrStatistics(
@@ -0,0 +1,44 @@
+"""
+Кэш результатов распознавания в Redis по содержимому изображения
+"""
+import hashlib
+from typing import BinaryIO, List, Optional, Sequence
+
+import orjson
+
+from app.config import settings
+from app.database import get_redis
+
+# Размер блока при чтении загруженного файла для хеширования
+HASH_CHUNK_SIZE = 64 * 1024
+
+def compute_cache_key(source: BinaryIO, languages: Sequence[str], preprocess: bool) -> str:
+    """
+    Ключ кэша по содержимому загруженного файла. Ключ учитывает языки
+    и предобработку, так как от них зависит результат.
+    Файл читается блоками (целиком в память не загружается), после чего
+    возвращается в начало для декодирования.
+    Выполняется в пуле потоков (hashlib освобождает GIL на больших данных).
+    """
+    digest = hashlib.blake2b(digest_size=16)
+    while chunk := source.read(HASH_CHUNK_SIZE):
+        digest.update(chunk)
+    source.seek(0)
+    return f"ocr:{digest.hexdigest()}:{'+'.join(languages)}:{int(preprocess)}"
+
+async def get_cached_result(key: str) -> Optional[List[list]]:
+    """
+    Результат распознавания из кэша (None, если его нет)
+    """
+    cached = await get_redis().get(key)
+    if cached is None:
+        return None
+    return orjson.loads(cached)
+
+async def cache_result(key: str, result: list) -> None:
+    """
+    Сохранение результата распознавания в кэш на OCR_RESULT_CACHE_TTL
+    """
+    # EasyOCR возвращает координаты и уверенность в типах numpy
+    payload = orjson.dumps(result, option=orjson.OPT_SERIALIZE_NUMPY)
+    await get_redis().set(key, payload, ex=settings.OCR_RESULT_CACHE_TTL)
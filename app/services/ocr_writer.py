@@ -0,0 +1,161 @@
+"""
+Буферизованная запись запросов OCR в базу данных.
+
+Запросы записываются пачками фоновой задачей. Счетчики статистики
+(ocr_stats_counters) и общий счетчик запросов пользователя увеличиваются
+в той же задаче и только для документов, которые действительно записаны,
+поэтому ошибка записи пачки не завышает статистику.
+"""
+import asyncio
+import logging
+from collections import Counter
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+
+from app.database import get_database
+
+logger = logging.getLogger(__name__)
+
+# Запись выполняется пачками: не больше OCR_WRITE_BATCH_SIZE документов
+# и не реже, чем раз в OCR_WRITE_INTERVAL секунд
+OCR_WRITE_BATCH_SIZE = 500
+OCR_WRITE_INTERVAL = 0.2
+
+_queue: Optional[asyncio.Queue] = None
+_flusher: Optional[asyncio.Task] = None
+
+def _day_start(moment: datetime) -> datetime:
+    """
+    Начало суток (UTC) для заданного момента
+    """
+    return moment.replace(hour=0, minute=0, second=0, microsecond=0)
+
+async def _update_counters(documents: List[Dict[str, Any]]) -> None:
+    """
+    Увеличение счетчиков статистики по языку и по дню и общих счетчиков
+    пользователей для записанных документов (одна операция на счетчик)
+    """
+    db = get_database()
+    by_language = Counter(document["language"] for document in documents)
+    by_day = Counter(_day_start(document["created_at"]) for document in documents)
+    by_user = Counter(document["user_id"] for document in documents)
+    
+    stats_updates = [
+        UpdateOne({"_id": f"l:{language}"}, {"$inc": {"count": count}}, upsert=True)
+        for language, count in by_language.items()
+    ] + [
+        UpdateOne(
+            {"_id": f"d:{day.strftime('%Y-%m-%d')}"},
+            {"$inc": {"count": count}, "$setOnInsert": {"date": day}},
+            upsert=True
+        )
+        for day, count in by_day.items()
+    ]
+    user_updates = [
+        UpdateOne({"_id": user_id}, {"$inc": {"request_count": count}})
+        for user_id, count in by_user.items()
+    ]
+    await asyncio.gather(
+        db.ocr_stats_counters.bulk_write(stats_updates, ordered=False),
+        db.users.bulk_write(user_updates, ordered=False)
+    )
+
+async def _write_batch(batch: List[Dict[str, Any]]) -> None:
+    """
+    Запись пачки документов и обновление счетчиков для записанных
+    (ошибка записи не останавливает фоновую задачу)
+    """
+    written = batch
+    try:
+        await get_database().ocr_requests.insert_many(batch, ordered=False)
+    except BulkWriteError as e:
+        # При ordered=False остальные документы пачки записаны
+        failed = {error["index"] for error in e.details.get("writeErrors", [])}
+        written = [document for index, document in enumerate(batch) if index not in failed]
+        logger.error("Не удалось сохранить %d из %d запросов OCR", len(failed), len(batch))
+    except Exception:
+        logger.exception("Не удалось сохранить %d запросов OCR", len(batch))
+        return
+    
+    if not written:
+        return
+    try:
+        await _update_counters(written)
+    except Exception:
+        logger.exception("Не удалось обновить счетчики для %d запросов OCR", len(written))
+
+async def _flush_loop() -> None:
+    """
+    Фоновая задача: собирает документы из очереди и записывает их пачками.
+    None в очереди - сигнал остановки после записи накопленного.
+    """
+    loop = asyncio.get_running_loop()
+    while True:
+        document = await _queue.get()
+        if document is None:
+            _queue.task_done()
+            return
+        
+        batch = [document]
+        stop = False
+        deadline = loop.time() + OCR_WRITE_INTERVAL
+        while len(batch) < OCR_WRITE_BATCH_SIZE:
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                document = await asyncio.wait_for(_queue.get(), timeout)
+            except asyncio.TimeoutError:
+                break
+            if document is None:
+                stop = True
+                break
+            batch.append(document)
+        
+        await _write_batch(batch)
+        # Отмечаем обработанными документы пачки (и сигнал остановки)
+        for _ in range(len(batch) + stop):
+            _queue.task_done()
+        if stop:
+            return
+
+def start_ocr_writer() -> None:
+    """
+    Запуск фоновой записи (при старте приложения, после подключения к MongoDB)
+    """
+    global _queue, _flusher
+    _queue = asyncio.Queue()
+    _flusher = asyncio.create_task(_flush_loop())
+
+async def stop_ocr_writer() -> None:
+    """
+    Остановка фоновой записи с сохранением всех накопленных документов
+    """
+    global _queue, _flusher
+    if _flusher is None:
+        return
+    _queue.put_nowait(None)
+    await _flusher
+    _queue = None
+    _flusher = None
+
+async def flush_ocr_writer() -> None:
+    """
+    Ожидание записи всех документов, поставленных в очередь к этому моменту
+    """
+    if _queue is not None:
+        await _queue.join()
+
+async def enqueue_ocr_request(ocr_request: Dict[str, Any]) -> None:
+    """
+    Постановка запроса OCR в очередь на запись. Если фоновая запись уже
+    остановлена (запрос завершается во время остановки приложения),
+    документ записывается сразу.
+    """
+    if _queue is None:
+        await _write_batch([ocr_request])
+        return
+    _queue.put_nowait(ocr_request)
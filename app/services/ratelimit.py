@@ -0,0 +1,55 @@
+"""
+Счетчики лимита запросов в Redis
+"""
+from datetime import datetime, timedelta
+from typing import Optional
+
+from app.database import get_redis
+
+# Окно лимита - последние 24 часа, по одному ключу на час
+WINDOW_HOURS = 24
+BUCKET_TTL_SECONDS = WINDOW_HOURS * 3600
+
+def _bucket_key(user_id: str, moment: datetime) -> str:
+    """
+    Ключ часового счетчика пользователя
+    """
+    return f"ocrq:{user_id}:{moment.strftime('%Y%m%d%H')}"
+
+async def reserve_request(user_id: str, request_limit: int) -> Optional[str]:
+    """
+    Резервирует запрос пользователя в счетчике текущего часа и проверяет,
+    что за последние 24 часа лимит не превышен. Увеличение счетчика и
+    чтение окна выполняются одним пакетом, поэтому одновременные запросы
+    не могут пройти проверку все сразу. Отклоненный запрос в счетчике
+    не остается.
+    
+    Returns:
+        ключ счетчика для возврата резерва (release_request) или None,
+        если лимит исчерпан
+    """
+    redis = get_redis()
+    now = datetime.utcnow()
+    current_key = _bucket_key(user_id, now)
+    window_keys = [
+        _bucket_key(user_id, now - timedelta(hours=hours))
+        for hours in range(WINDOW_HOURS)
+    ]
+    
+    async with redis.pipeline(transaction=False) as pipe:
+        pipe.incr(current_key)
+        pipe.expire(current_key, BUCKET_TTL_SECONDS)
+        pipe.mget(window_keys)
+        _, _, counts = await pipe.execute()
+    
+    total = sum(int(count) for count in counts if count is not None)
+    if total > request_limit:
+        await redis.decr(current_key)
+        return None
+    return current_key
+
+async def release_request(key: str) -> None:
+    """
+    Возврат резерва запроса, который не был выполнен
+    """
+    await get_redis().decr(key)
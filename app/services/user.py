@@ -4,22 +4,66 @@
 from typing import Dict, Any, List, Optional
 from fastapi import HTTPException, status
 from bson import ObjectId
+from pymongo import UpdateOne
 import math
 
 from app.database import get_database
-from app.models.user import UserOut, UserUpdate, UserStats, AdminUserUpdate
+from app.services.ocr_writer import flush_ocr_writer
+from app.utils.security import USER_PUBLIC_PROJECTION
+from app.models.user import UserOut, UserUpdate, UserStats, AdminUserUpdate, AdminUserInfo
+from app.models.admin import UsersList
+
+# Поля пользователя, необходимые для UserStats (без hashed_password и прочего)
+USER_STATS_PROJECTION = {
+    "username": 1,
+    "email": 1,
+    "is_premium": 1,
+    "is_admin": 1,
+    "is_active": 1,
+    "created_at": 1,
+    "request_count": 1
+}
 
 def user_to_response(user: Dict[str, Any]) -> UserOut:
     """
     Преобразование объекта пользователя из БД в модель ответа API
     """
-    return UserOut(
-        id=str(user["_id"]),
-        email=user["email"],
-        username=user["username"],
-        is_premium=user["is_premium"],
-        is_admin=user.get("is_admin", False),
-        created_at=user["created_at"]
+    return UserOut.model_validate(user)
+
+async def backfill_request_counts() -> None:
+    """
+    Заполнение счетчика request_count у пользователей, созданных
+    до его появления (выполняется при запуске, если такие есть)
+    """
+    db = get_database()
+    
+    missing = await db.users.find_one({"request_count": {"$exists": False}}, projection={"_id": 1})
+    if missing is None:
+        return
+    
+    print("Заполнение счетчиков запросов пользователей...")
+    pipeline = [
+        {
+            "$group": {
+                "_id": "$user_id",
+                "request_count": {"$sum": 1}
+            }
+        },
+        {
+            "$merge": {
+                "into": "users",
+                "on": "_id",
+                "whenMatched": "merge",
+                "whenNotMatched": "discard"
+            }
+        }
+    ]
+    await db.ocr_requests.aggregate(pipeline).to_list(length=None)
+    
+    # Пользователи без запросов
+    await db.users.update_many(
+        {"request_count": {"$exists": False}},
+        {"$set": {"request_count": 0}}
     )
 
 async def get_user_profile(user_id: str) -> UserOut:
@@ -27,7 +71,7 @@ async def get_user_profile(user_id: str) -> UserOut:
     Получение профиля пользователя
     """
     db = get_database()
-    user = await db.users.find_one({"_id": ObjectId(user_id)})
+    user = await db.users.find_one({"_id": ObjectId(user_id)}, projection=USER_PUBLIC_PROJECTION)
     
     if not user:
         raise HTTPException(
@@ -44,7 +88,7 @@ async def update_user_profile(user_id: str, user_data: UserUpdate) -> UserOut:
     db = get_database()
     
     # Проверяем существование пользователя
-    user = await db.users.find_one({"_id": ObjectId(user_id)})
+    user = await db.users.find_one({"_id": ObjectId(user_id)}, projection={"_id": 1})
     if not user:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -56,7 +100,10 @@ async def update_user_profile(user_id: str, user_data: UserUpdate) -> UserOut:
     
     if user_data.email is not None:
         # Проверяем, что email не занят другим пользователем
-        existing_user = await db.users.find_one({"email": user_data.email, "_id": {"$ne": ObjectId(user_id)}})
+        existing_user = await db.users.find_one(
+            {"email": user_data.email, "_id": {"$ne": ObjectId(user_id)}},
+            projection={"_id": 1}
+        )
         if existing_user:
             raise HTTPException(
                 status_code=status.HTTP_400_BAD_REQUEST,
@@ -75,25 +122,22 @@ async def update_user_profile(user_id: str, user_data: UserUpdate) -> UserOut:
         )
     
     # Получаем обновленного пользователя
-    updated_user = await db.users.find_one({"_id": ObjectId(user_id)})
+    updated_user = await db.users.find_one({"_id": ObjectId(user_id)}, projection=USER_PUBLIC_PROJECTION)
     
     return user_to_response(updated_user)
 
-async def get_users_list(page: int = 1, limit: int = 10) -> Dict[str, Any]:
+async def get_users_list(page: int = 1, limit: int = 10) -> UsersList:
     """
     Получение списка пользователей с пагинацией для админ-панели
     """
     db = get_database()
     skip = (page - 1) * limit
     
-    # Получаем пользователей с пагинацией
-    users_cursor = db.users.find().sort("created_at", -1).skip(skip).limit(limit)
-    users = []
-    
-    async for user in users_cursor:
-        # Подсчет количества запросов для каждого пользователя
-        request_count = await db.ocr_requests.count_documents({"user_id": user["_id"]})
-        users.append(UserStats(
+    # Получаем пользователей с пагинацией (количество запросов хранится
+    # в самом документе пользователя, отдельный подсчет не нужен)
+    users_cursor = db.users.find({}, projection=USER_STATS_PROJECTION).sort("created_at", -1).skip(skip).limit(limit)
+    users = [
+        UserStats.model_construct(
             id=str(user["_id"]),
             username=user["username"],
             email=user["email"],
@@ -101,29 +145,31 @@ async def get_users_list(page: int = 1, limit: int = 10) -> Dict[str, Any]:
             is_active=user.get("is_active", True),
             is_premium=user.get("is_premium", False),
             is_admin=user.get("is_admin", False),
-            request_count=request_count
-        ))
+            request_count=user.get("request_count", 0)
+        )
+        async for user in users_cursor
+    ]
     
-    # Общее количество пользователей (для пагинации)
-    total_users = await db.users.count_documents({})
+    # Общее количество пользователей (для пагинации) из метаданных коллекции
+    total_users = await db.users.estimated_document_count()
     total_pages = math.ceil(total_users / limit)
     
-    return {
-        "users": users,
-        "total": total_users,
-        "page": page,
-        "limit": limit,
-        "total_pages": total_pages
-    }
+    return UsersList.model_construct(
+        users=users,
+        total=total_users,
+        page=page,
+        limit=limit,
+        total_pages=total_pages
+    )
 
-async def admin_update_user(user_id: str, user_data: AdminUserUpdate) -> Dict[str, Any]:
+async def admin_update_user(user_id: str, user_data: AdminUserUpdate) -> AdminUserInfo:
     """
     Обновление пользователя администратором
     """
     db = get_database()
     
     # Проверяем существование пользователя
-    user = await db.users.find_one({"_id": ObjectId(user_id)})
+    user = await db.users.find_one({"_id": ObjectId(user_id)}, projection={"_id": 1})
     if not user:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -135,7 +181,10 @@ async def admin_update_user(user_id: str, user_data: AdminUserUpdate) -> Dict[st
     
     if user_data.email is not None:
         # Проверяем, что email не занят другим пользователем
-        existing_user = await db.users.find_one({"email": user_data.email, "_id": {"$ne": ObjectId(user_id)}})
+        existing_user = await db.users.find_one(
+            {"email": user_data.email, "_id": {"$ne": ObjectId(user_id)}},
+            projection={"_id": 1}
+        )
         if existing_user:
             raise HTTPException(
                 status_code=status.HTTP_400_BAD_REQUEST,
@@ -160,17 +209,66 @@ async def admin_update_user(user_id: str, user_data: AdminUserUpdate) -> Dict[st
         )
     
     # Получаем обновленного пользователя
-    updated_user = await db.users.find_one({"_id": ObjectId(user_id)})
-    
-    return {
-        "id": str(updated_user["_id"]),
-        "username": updated_user["username"],
-        "email": updated_user["email"],
-        "is_active": updated_user.get("is_active", True),
-        "is_premium": updated_user.get("is_premium", False),
-        "is_admin": updated_user.get("is_admin", False),
-        "created_at": updated_user["created_at"]
-    }
+    updated_user = await db.users.find_one({"_id": ObjectId(user_id)}, projection=USER_PUBLIC_PROJECTION)
+    
+    return AdminUserInfo.model_construct(
+        id=str(updated_user["_id"]),
+        username=updated_user["username"],
+        email=updated_user["email"],
+        is_active=updated_user.get("is_active", True),
+        is_premium=updated_user.get("is_premium", False),
+        is_admin=updated_user.get("is_admin", False),
+        created_at=updated_user["created_at"]
+    )
+
+async def _subtract_ocr_stats(user_id: ObjectId) -> None:
+    """
+    Вычитание запросов пользователя из счетчиков статистики
+    (ocr_stats_counters) перед удалением этих запросов
+    """
+    db = get_database()
+    pipeline = [
+        {"$match": {"user_id": user_id}},
+        {
+            "$facet": {
+                "by_language": [
+                    {
+                        "$group": {
+                            "_id": {"$concat": ["l:", "$language"]},
+                            "count": {"$sum": 1}
+                        }
+                    }
+                ],
+                "by_day": [
+                    {
+                        "$group": {
+                            "_id": {
+                                "$concat": [
+                                    "d:",
+                                    {"$dateToString": {"format": "%Y-%m-%d", "date": "$created_at"}}
+                                ]
+                            },
+                            "count": {"$sum": 1}
+                        }
+                    }
+                ]
+            }
+        }
+    ]
+    facet = (await db.ocr_requests.aggregate(pipeline).to_list(length=None))[0]
+    counters = facet["by_language"] + facet["by_day"]
+    if not counters:
+        return
+    
+    await db.ocr_stats_counters.bulk_write([
+        UpdateOne({"_id": counter["_id"]}, {"$inc": {"count": -counter["count"]}})
+        for counter in counters
+    ], ordered=False)
+    # Обнулившиеся счетчики удаляются, чтобы не попадать в статистику
+    await db.ocr_stats_counters.delete_many({
+        "_id": {"$in": [counter["_id"] for counter in counters]},
+        "count": {"$lte": 0}
+    })
 
 async def admin_delete_user(user_id: str, admin_id: str) -> Dict[str, str]:
     """
@@ -179,7 +277,7 @@ async def admin_delete_user(user_id: str, admin_id: str) -> Dict[str, str]:
     db = get_database()
     
     # Проверяем существование пользователя
-    user = await db.users.find_one({"_id": ObjectId(user_id)})
+    user = await db.users.find_one({"_id": ObjectId(user_id)}, projection={"_id": 1})
     if not user:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -199,7 +297,11 @@ async def admin_delete_user(user_id: str, admin_id: str) -> Dict[str, str]:
     # Удаляем все связанные с пользователем refresh токены
     await db.refresh_tokens.delete_many({"user_id": ObjectId(user_id)})
     
-    # Удаляем или анонимизируем запросы OCR пользователя
+    # Удаляем запросы OCR пользователя вместе с их вкладом в счетчики
+    # статистики (сначала дожидаемся записи запросов из буфера, иначе они
+    # появятся в базе уже после удаления)
+    await flush_ocr_writer()
+    await _subtract_ocr_stats(ObjectId(user_id))
     await db.ocr_requests.delete_many({"user_id": ObjectId(user_id)})
     
     return {"detail": "Пользователь успешно удален"}
\ No newline at end of file
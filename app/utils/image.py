@@ -1,60 +1,232 @@
 """
 Утилиты для обработки изображений
 """
-from PIL import Image, ImageFilter, ImageEnhance
+import asyncio
+import gc
+import io
+import multiprocessing
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from typing import BinaryIO, Dict, Iterable, List, Optional, Sequence, Tuple, Union
+
+from fastapi.concurrency import run_in_threadpool
+from PIL import Image, ImageFilter, ImageOps
 import easyocr
 import torch
 import numpy as np
 
-# Глобальная переменная для ридера EasyOCR
-reader = None
+from app.config import settings
+
+# Защита от "бомб декомпрессии": слишком большие изображения не декодируются
+Image.MAX_IMAGE_PIXELS = settings.MAX_IMAGE_PIXELS
+
+# Ридеры EasyOCR по набору языков (LRU, не больше OCR_READER_CACHE_SIZE штук)
+_readers = OrderedDict()
+_readers_lock = threading.RLock()
+
+# Пул процессов для распознавания (None - распознавание в потоках текущего процесса)
+ocr_pool = None
+
+def _ocr_thread_workers() -> int:
+    """
+    Количество потоков распознавания: больше одновременных вызовов модели
+    только увеличивает конкуренцию за GPU/ядра CPU
+    """
+    if settings.OCR_THREAD_WORKERS > 0:
+        return settings.OCR_THREAD_WORKERS
+    if torch.cuda.is_available():
+        return torch.cuda.device_count()
+    return max(1, (os.cpu_count() or 2) // 2)
+
+# Отдельный ограниченный пул потоков для распознавания, чтобы OCR не занимал
+# общий пул потоков Starlette (создается при запуске приложения,
+# потоки - по мере необходимости)
+ocr_executor: Optional[ThreadPoolExecutor] = None
+
+def start_ocr_executor() -> ThreadPoolExecutor:
+    """
+    Создание пула потоков распознавания (при каждом запуске приложения:
+    после shutdown_ocr_pool прежний пул использовать нельзя)
+    """
+    global ocr_executor
+    ocr_executor = ThreadPoolExecutor(max_workers=_ocr_thread_workers(), thread_name_prefix="ocr")
+    return ocr_executor
+
+# Очереди пакетного распознавания по набору языков и обрабатывающие их задачи
+# (создаются при первом запросе, если OCR_BATCH_SIZE > 1)
+_batch_queues: Dict[Tuple[str, ...], asyncio.Queue] = {}
+_batch_workers: Dict[Tuple[str, ...], asyncio.Task] = {}
+
+def _autocast_dtype():
+    """
+    Тип для autocast при инференсе на GPU (None - полная точность).
+    Тензорные ядра для FP16 есть начиная с Volta (7.x), bfloat16 - с Ampere (8.x).
+    """
+    if not settings.OCR_USE_FP16 or not torch.cuda.is_available():
+        return None
+    major, _ = torch.cuda.get_device_capability()
+    if major < 7:
+        return None
+    if settings.OCR_HALF_DTYPE == "bfloat16" and major >= 8:
+        return torch.bfloat16
+    return torch.float16
 
-def init_ocr_reader():
+class _AutocastRecognizer(torch.nn.Module):
     """
-    Инициализация объекта EasyOCR
+    Модель распознавания строк под autocast: веса и входы остаются FP32,
+    свертки и матричные операции выполняются в половинной точности.
+    Детектор CRAFT не оборачивается - его выход EasyOCR передает в OpenCV,
+    который не принимает половинную точность; выход распознавателя
+    возвращается в float32 по той же причине (EasyOCR вызывает .numpy()).
     """
-    global reader
+    def __init__(self, model: torch.nn.Module, dtype: torch.dtype):
+        super().__init__()
+        self.model = model
+        self.dtype = dtype
+    
+    def forward(self, *args, **kwargs):
+        device_type = next(self.model.parameters()).device.type
+        with torch.autocast(device_type=device_type, dtype=self.dtype):
+            output = self.model(*args, **kwargs)
+        return output.float()
+
+def _reader_key(languages: Sequence[str]) -> Tuple[str, ...]:
+    """
+    Ключ кэша ридеров: порядок языков на выбор модели EasyOCR не влияет
+    """
+    return tuple(sorted(languages))
+
+def _free_model_memory() -> None:
+    """
+    Освобождение памяти моделей вытесненных ридеров. Вызывается, когда
+    ссылок на ридеры уже не осталось, иначе память не освобождается.
+    """
+    gc.collect()
+    if torch.cuda.is_available():
+        torch.cuda.empty_cache()
+
+def init_ocr_reader(languages: Sequence[str] = settings.DEFAULT_OCR_LANGUAGES):
+    """
+    Инициализация объекта EasyOCR для заданного набора языков
+    """
+    key = _reader_key(languages)
     try:
-        print("Загрузка модели EasyOCR для русского и английского языков...")
-        reader = easyocr.Reader(['en', 'ru'], gpu=torch.cuda.is_available())
+        print(f"Загрузка модели EasyOCR для языков: {', '.join(key)}...")
+        reader = easyocr.Reader(
+            list(key),
+            gpu=torch.cuda.is_available(),
+            cudnn_benchmark=settings.OCR_CUDNN_BENCHMARK
+        )
+        if settings.OCR_TORCH_COMPILE:
+            # Ширина строк меняется от запроса к запросу, поэтому компиляция
+            # с динамическими размерами, без перекомпиляции на каждую ширину
+            reader.recognizer = torch.compile(reader.recognizer, dynamic=True)
+        half_dtype = _autocast_dtype()
+        if half_dtype is not None:
+            reader.recognizer = _AutocastRecognizer(reader.recognizer, half_dtype)
         print("Модель EasyOCR успешно загружена")
-        return reader
     except Exception as e:
         print(f"Ошибка при загрузке модели EasyOCR: {str(e)}")
         raise e
+    
+    with _readers_lock:
+        _readers[key] = reader
+        _readers.move_to_end(key)
+        # Вытесняем давно не использовавшиеся ридеры (ссылки на них
+        # не сохраняются, чтобы сборщик мог освободить модели)
+        evicted = 0
+        while len(_readers) > settings.OCR_READER_CACHE_SIZE:
+            _readers.popitem(last=False)
+            evicted += 1
+    
+    if evicted:
+        _free_model_memory()
+    
+    return reader
 
-def get_ocr_reader():
+def init_ocr_readers(language_sets: Iterable[Sequence[str]]):
     """
-    Получение объекта EasyOCR
+    Предварительная загрузка ридеров для всех наборов языков, чтобы первый
+    запрос на каждом языке не ждал загрузки модели (наборов загружается
+    не больше, чем помещается в кэш)
     """
-    global reader
-    if reader is None:
-        reader = init_ocr_reader()
-    return reader
+    keys = list(dict.fromkeys(_reader_key(languages) for languages in language_sets))
+    for key in keys[:settings.OCR_READER_CACHE_SIZE]:
+        init_ocr_reader(key)
+
+def get_ocr_reader(languages: Sequence[str] = settings.DEFAULT_OCR_LANGUAGES):
+    """
+    Получение объекта EasyOCR для заданного набора языков
+    """
+    key = _reader_key(languages)
+    # Загрузка под блокировкой, чтобы параллельные запросы не грузили модель дважды
+    with _readers_lock:
+        reader = _readers.get(key)
+        if reader is None:
+            return init_ocr_reader(key)
+        _readers.move_to_end(key)
+        return reader
+
+def _needs_enhancement(image_np) -> Tuple[bool, bool]:
+    """
+    Нужны ли изображению увеличение контраста и резкости.
+    Оценка по выборке из каждого 8-го пикселя по обеим осям: контраст -
+    по стандартному отклонению яркости, резкость - по дисперсии лапласиана
+    
+    Returns:
+        (нужен ли контраст, нужна ли резкость)
+    """
+    sample = image_np[::8, ::8]
+    if sample.shape[0] < 3 or sample.shape[1] < 3:
+        return True, True
+    if sample.ndim == 3:
+        if sample.shape[2] == 3:
+            sample = sample @ np.array([0.299, 0.587, 0.114], dtype=np.float32)
+        else:
+            sample = sample[:, :, 0]
+    sample = sample.astype(np.float32, copy=False)
+    
+    laplacian = (
+        4.0 * sample[1:-1, 1:-1]
+        - sample[:-2, 1:-1] - sample[2:, 1:-1]
+        - sample[1:-1, :-2] - sample[1:-1, 2:]
+    )
+    return (
+        float(sample.std()) <= settings.OCR_SKIP_CONTRAST_STD,
+        float(laplacian.var()) <= settings.OCR_SKIP_SHARPEN_LAPLACIAN_VAR
+    )
 
-def preprocess_image(image, enhance_contrast=1.5, sharpen=True):
+def preprocess_image(image_np, autocontrast_cutoff=2.0, sharpen=True):
     """
     Улучшает качество изображения для лучшего распознавания текста
     
     Args:
-        image: PIL.Image - входное изображение
-        enhance_contrast: float - коэффициент увеличения контраста
+        image_np: numpy.ndarray - изображение (uint8, H x W x C или H x W)
+        autocontrast_cutoff: float - процент отбрасываемых при автоконтрасте
+            самых темных и самых светлых пикселей
         sharpen: bool - применять ли увеличение резкости
         
     Returns:
-        PIL.Image - обработанное изображение
+        numpy.ndarray - обработанное изображение той же формы
+        (исходный массив, если изображение и так контрастное и резкое)
     """
-    # Увеличение контраста
-    enhancer = ImageEnhance.Contrast(image)
-    image = enhancer.enhance(enhance_contrast)
+    need_contrast, need_sharpen = _needs_enhancement(image_np)
+    sharpen = sharpen and need_sharpen
+    if not need_contrast and not sharpen:
+        return image_np
     
-    # Увеличение резкости
+    image = Image.fromarray(image_np)
+    if need_contrast:
+        # Таблица по гистограмме: дешевле, чем смешивание в ImageEnhance.Contrast
+        image = ImageOps.autocontrast(image, cutoff=autocontrast_cutoff)
     if sharpen:
         image = image.filter(ImageFilter.SHARPEN)
-    
-    return image
+    return np.asarray(image)
 
-def perform_ocr(image_np, languages=['en', 'ru']):
+def perform_ocr(image_np, languages=settings.DEFAULT_OCR_LANGUAGES):
     """
     Выполняет распознавание текста на изображении
     
@@ -65,5 +237,231 @@ def perform_ocr(image_np, languages=['en', 'ru']):
     Returns:
         list - результаты распознавания
     """
-    ocr_reader = get_ocr_reader()
-    return ocr_reader.readtext(image_np)
\ No newline at end of file
+    ocr_reader = get_ocr_reader(languages)
+    return ocr_reader.readtext(image_np)
+
+def _pad_to_common_shape(images: List[np.ndarray]) -> List[np.ndarray]:
+    """
+    Дополнение изображений пакета белым фоном справа и снизу до общего
+    размера. В отличие от масштабирования, пропорции текста и координаты
+    найденных областей не меняются.
+    """
+    height = max(image.shape[0] for image in images)
+    width = max(image.shape[1] for image in images)
+    padded = []
+    for image in images:
+        if image.shape[:2] == (height, width):
+            padded.append(image)
+            continue
+        canvas = np.full((height, width) + image.shape[2:], 255, dtype=np.uint8)
+        canvas[:image.shape[0], :image.shape[1]] = image
+        padded.append(canvas)
+    return padded
+
+def perform_ocr_batch(images: List[np.ndarray], languages=settings.DEFAULT_OCR_LANGUAGES) -> List[list]:
+    """
+    Распознавание нескольких изображений одним вызовом модели
+    
+    Args:
+        images: list - изображения (одного режима: все RGB или все в оттенках серого)
+        languages: list - список языков для распознавания
+        
+    Returns:
+        list - результаты распознавания для каждого изображения
+    """
+    ocr_reader = get_ocr_reader(languages)
+    batch = _pad_to_common_shape(images)
+    return ocr_reader.readtext_batched(batch)
+
+def decode_image(source: Union[bytes, BinaryIO], preprocess: bool) -> np.ndarray:
+    """
+    Декодирование изображения в массив для EasyOCR
+    
+    Args:
+        source: bytes или файловый объект - содержимое изображения
+        preprocess: bool - применять ли предобработку
+        
+    Returns:
+        numpy.ndarray - изображение в оттенках серого (uint8, H x W)
+        или RGB (uint8, H x W x 3), если OCR_GRAYSCALE выключен
+    """
+    if isinstance(source, (bytes, bytearray)):
+        source = io.BytesIO(source)
+    image = Image.open(source)
+    
+    # EasyOCR распознает текст по изображению в оттенках серого, поэтому
+    # цвет не нужен: массив в 3 раза меньше, а JPEG декодируется сразу
+    # в яркость (draft без уменьшения размера; для других форматов ничего не делает)
+    mode = "L" if settings.OCR_GRAYSCALE else "RGB"
+    if mode == "L":
+        image.draft("L", image.size)
+    
+    # convert() всегда создает копию, поэтому вызываем его только
+    # при необходимости
+    if image.mode != mode:
+        image = image.convert(mode)
+    
+    # Преобразование в numpy array для EasyOCR. Изображение декодируется
+    # сразу (load), а asarray использует буфер __array_interface__ без
+    # повторного копирования, как в np.array. Массив только для чтения:
+    # ни предобработка, ни EasyOCR не изменяют его на месте
+    image.load()
+    img_np = np.asarray(image)
+    
+    # Предобработка изображения при необходимости
+    if preprocess:
+        img_np = preprocess_image(img_np)
+    
+    # EasyOCR копирует массив с другим типом или шагами при переносе в тензор;
+    # для массивов из PIL (в том числе после предобработки) копии здесь не происходит
+    if img_np.dtype != np.uint8 or not img_np.flags["C_CONTIGUOUS"]:
+        img_np = np.ascontiguousarray(img_np, dtype=np.uint8)
+    
+    return img_np
+
+def recognize_image(
+    source: Union[bytes, BinaryIO],
+    languages: Sequence[str],
+    preprocess: bool
+) -> list:
+    """
+    Полный цикл распознавания: декодирование, предобработка и OCR
+    
+    Args:
+        source: bytes или файловый объект - содержимое изображения
+        languages: list - список языков для распознавания
+        preprocess: bool - применять ли предобработку
+        
+    Returns:
+        list - результаты распознавания
+    """
+    img_np = decode_image(source, preprocess)
+    return perform_ocr(img_np, languages)
+
+def _init_ocr_worker(language_sets: Tuple[Tuple[str, ...], ...]):
+    """
+    Инициализация процесса пула: ридеры EasyOCR
+    """
+    init_ocr_readers(language_sets)
+
+def _worker_pid() -> int:
+    """
+    Задача прогрева пула: выполняется после инициализации процесса.
+    Небольшая пауза не дает одному процессу забрать все задачи прогрева.
+    """
+    time.sleep(0.1)
+    return os.getpid()
+
+def init_ocr_pool(language_sets: Iterable[Sequence[str]]):
+    """
+    Создание пула процессов для распознавания.
+    Каждый процесс один раз загружает свои ридеры EasyOCR при старте.
+    Процессы запускаются через spawn: CUDA, уже инициализированную
+    в родительском процессе, нельзя использовать после fork.
+    ProcessPoolExecutor запускает процессы по мере поступления задач, поэтому
+    функция ждет, пока каждый процесс не выполнит задачу прогрева: первые
+    запросы не ждут загрузки моделей.
+    """
+    global ocr_pool
+    print(f"Запуск пула распознавания на {settings.OCR_PROCESS_WORKERS} процессов...")
+    ocr_pool = ProcessPoolExecutor(
+        max_workers=settings.OCR_PROCESS_WORKERS,
+        mp_context=multiprocessing.get_context("spawn"),
+        initializer=_init_ocr_worker,
+        initargs=(tuple(tuple(languages) for languages in language_sets),)
+    )
+    
+    ready = set()
+    while len(ready) < settings.OCR_PROCESS_WORKERS:
+        futures = [ocr_pool.submit(_worker_pid) for _ in range(settings.OCR_PROCESS_WORKERS)]
+        ready.update(future.result() for future in futures)
+    print(f"Пул распознавания готов: {len(ready)} процессов")
+    return ocr_pool
+
+def stop_batch_workers():
+    """
+    Остановка задач пакетного распознавания (в цикле событий)
+    """
+    for worker in _batch_workers.values():
+        worker.cancel()
+    _batch_workers.clear()
+    _batch_queues.clear()
+
+def shutdown_ocr_pool():
+    """
+    Остановка пулов распознавания с ожиданием текущих задач
+    (блокирующая, вызывается вне цикла событий)
+    """
+    global ocr_pool, ocr_executor
+    if ocr_pool is not None:
+        ocr_pool.shutdown(wait=True)
+        ocr_pool = None
+    if ocr_executor is not None:
+        ocr_executor.shutdown(wait=True)
+        ocr_executor = None
+
+async def _batch_worker(key: Tuple[str, ...], queue: asyncio.Queue) -> None:
+    """
+    Фоновая задача: собирает изображения одного набора языков в течение
+    OCR_BATCH_WINDOW_MS (не больше OCR_BATCH_SIZE) и распознает их одним
+    вызовом модели, возвращая результаты через futures ожидающих запросов
+    """
+    loop = asyncio.get_running_loop()
+    window = settings.OCR_BATCH_WINDOW_MS / 1000
+    while True:
+        items = [await queue.get()]
+        deadline = loop.time() + window
+        while len(items) < settings.OCR_BATCH_SIZE:
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                items.append(await asyncio.wait_for(queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        
+        images = [image for image, _ in items]
+        try:
+            results = await loop.run_in_executor(ocr_executor, perform_ocr_batch, images, key)
+        except Exception as e:
+            for _, future in items:
+                if not future.done():
+                    future.set_exception(e)
+            continue
+        
+        for (_, future), result in zip(items, results):
+            if not future.done():
+                future.set_result(result)
+
+async def _recognize_batched(image_np: np.ndarray, languages: Sequence[str]) -> list:
+    """
+    Распознавание изображения в составе пакета одновременных запросов
+    """
+    key = _reader_key(languages)
+    queue = _batch_queues.get(key)
+    if queue is None:
+        queue = _batch_queues[key] = asyncio.Queue()
+        _batch_workers[key] = asyncio.create_task(_batch_worker(key, queue))
+    
+    future = asyncio.get_running_loop().create_future()
+    queue.put_nowait((image_np, future))
+    return await future
+
+async def run_ocr(source: Union[bytes, BinaryIO], languages: Sequence[str], preprocess: bool) -> list:
+    """
+    Распознавание текста вне цикла событий: в пуле процессов, если он
+    запущен, иначе в пуле потоков распознавания текущего процесса
+    (пакетами, если OCR_BATCH_SIZE > 1)
+    """
+    loop = asyncio.get_running_loop()
+    if ocr_pool is not None:
+        # Файловый объект нельзя передать в другой процесс, передаем байты
+        if not isinstance(source, (bytes, bytearray)):
+            source = await run_in_threadpool(source.read)
+        return await loop.run_in_executor(
+            ocr_pool, recognize_image, source, tuple(languages), preprocess
+        )
+    if settings.OCR_BATCH_SIZE > 1:
+        img_np = await run_in_threadpool(decode_image, source, preprocess)
+        return await _recognize_batched(img_np, languages)
+    return await loop.run_in_executor(ocr_executor, recognize_image, source, languages, preprocess)
\ No newline at end of file
@@ -1,30 +1,121 @@
 """
 Утилиты для безопасности и аутентификации
 """
-import uuid
+import hashlib
+import hmac
+import secrets
+import threading
+import time
+from collections import OrderedDict
 from datetime import datetime, timedelta
 from typing import Optional, Dict, Any
 
+import bcrypt
 import jwt
+from argon2 import PasswordHasher
+from argon2.exceptions import InvalidHashError, VerificationError
 from fastapi import Depends, HTTPException, status
+from fastapi.concurrency import run_in_threadpool
 from fastapi.security import OAuth2PasswordBearer
-from passlib.context import CryptContext
 from bson import ObjectId
+from bson.errors import InvalidId
 
-from app.config import SECRET_KEY, ALGORITHM, ACCESS_TOKEN_EXPIRE_MINUTES
+from app.config import settings
 from app.database import get_database
 
 # Утилиты безопасности
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="login")
 
+# Поля пользователя для входа и данных токена
+USER_AUTH_PROJECTION = {
+    "username": 1,
+    "hashed_password": 1,
+    "is_active": 1,
+    "is_admin": 1,
+    "is_premium": 1
+}
+
+# Все поля пользователя, кроме хеша пароля
+USER_PUBLIC_PROJECTION = {"hashed_password": 0}
+
+# Новые пароли хешируются argon2id, хеши bcrypt от ранее созданных
+# пользователей проверяются как раньше и заменяются при входе
+password_hasher = PasswordHasher()
+
+# Успешные проверки пароля (LRU): HMAC от хеша и пароля -> момент проверки.
+# Сам пароль не хранится, неудачные проверки не кэшируются
+_verified_passwords = OrderedDict()
+_verified_passwords_lock = threading.Lock()
+
+# Проверенные токены доступа (LRU): хеш токена -> (пользователь, срок действия).
+# Используется только из цикла событий, блокировка не нужна
+_verified_tokens = OrderedDict()
+
+def _password_cache_key(plain_password: str, hashed_password: str) -> bytes:
+    """
+    Ключ кэша проверок: смена пароля (хеша) делает старые записи бесполезными
+    """
+    return hmac.new(
+        settings.SECRET_KEY.encode("utf-8"),
+        f"{hashed_password}:{plain_password}".encode("utf-8"),
+        hashlib.sha256
+    ).digest()
+
+def _check_password(plain_password: str, hashed_password: str) -> bool:
+    """
+    Проверка пароля по хешу argon2id или bcrypt
+    """
+    if hashed_password.startswith("$argon2"):
+        try:
+            return password_hasher.verify(hashed_password, plain_password)
+        except (VerificationError, InvalidHashError):
+            return False
+    return bcrypt.checkpw(plain_password.encode("utf-8"), hashed_password.encode("utf-8"))
+
+def password_needs_rehash(hashed_password: str) -> bool:
+    """
+    Нужно ли пересчитать хеш (bcrypt или устаревшие параметры argon2)
+    """
+    if not hashed_password.startswith("$argon2"):
+        return True
+    return password_hasher.check_needs_rehash(hashed_password)
+
+# argon2 и bcrypt - нативные реализации, освобождают GIL на время хеширования,
+# поэтому вызываются из пула потоков и не блокируют цикл событий
 def verify_password(plain_password: str, hashed_password: str) -> bool:
-    """Проверка пароля"""
-    return pwd_context.verify(plain_password, hashed_password)
+    """Проверка пароля (повторный вход в течение PASSWORD_VERIFY_CACHE_TTL без bcrypt)"""
+    key = _password_cache_key(plain_password, hashed_password)
+    with _verified_passwords_lock:
+        verified_at = _verified_passwords.get(key)
+        if verified_at is not None and time.monotonic() - verified_at < settings.PASSWORD_VERIFY_CACHE_TTL:
+            return True
+    
+    if not _check_password(plain_password, hashed_password):
+        return False
+    
+    with _verified_passwords_lock:
+        _verified_passwords[key] = time.monotonic()
+        _verified_passwords.move_to_end(key)
+        while len(_verified_passwords) > settings.PASSWORD_VERIFY_CACHE_SIZE:
+            _verified_passwords.popitem(last=False)
+    return True
 
 def get_password_hash(password: str) -> str:
-    """Получение хеша пароля"""
-    return pwd_context.hash(password)
+    """Получение хеша пароля (argon2id)"""
+    return password_hasher.hash(password)
+
+def build_token_claims(user: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Данные пользователя, которые кладутся в токен доступа, чтобы
+    не загружать пользователя из БД на каждом запросе
+    """
+    return {
+        "sub": user["username"],
+        "uid": str(user["_id"]),
+        "act": user.get("is_active", True),
+        "adm": user.get("is_admin", False),
+        "prem": user.get("is_premium", False)
+    }
 
 def create_access_token(data: Dict[str, Any], expires_delta: Optional[timedelta] = None) -> tuple:
     """
@@ -34,21 +125,28 @@ def create_access_token(data: Dict[str, Any], expires_delta: Optional[timedelta]
     if expires_delta:
         expire = datetime.utcnow() + expires_delta
     else:
-        expire = datetime.utcnow() + timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
+        expire = datetime.utcnow() + timedelta(minutes=settings.ACCESS_TOKEN_EXPIRE_MINUTES)
     to_encode.update({"exp": expire})
-    encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
+    encoded_jwt = jwt.encode(to_encode, settings.SECRET_KEY, algorithm=settings.ALGORITHM)
     return encoded_jwt, expire
 
+def hash_refresh_token(token: str) -> bytes:
+    """
+    Хеш refresh токена: в БД хранится только он, поэтому утечка
+    коллекции не дает действующих токенов
+    """
+    return hashlib.sha256(token.encode("utf-8")).digest()
+
 async def create_refresh_token(user_id: str) -> tuple:
     """
-    Создание refresh токена
+    Создание refresh токена (256 бит случайных данных)
     """
     db = get_database()
-    token_value = str(uuid.uuid4())
-    expires_at = datetime.utcnow() + timedelta(days=7)
+    token_value = secrets.token_urlsafe(32)
+    expires_at = datetime.utcnow() + timedelta(days=settings.REFRESH_TOKEN_EXPIRE_DAYS)
     
     refresh_token = {
-        "token": token_value,
+        "token_hash": hash_refresh_token(token_value),
         "user_id": ObjectId(user_id),
         "expires_at": expires_at,
         "created_at": datetime.utcnow(),
@@ -64,7 +162,14 @@ async def get_user_by_username(username: str):
     Получение пользователя по имени
     """
     db = get_database()
-    return await db.users.find_one({"username": username})
+    return await db.users.find_one({"username": username}, projection=USER_AUTH_PROJECTION)
+
+async def get_user_public(user_id: ObjectId):
+    """
+    Получение пользователя по идентификатору (без хеша пароля)
+    """
+    db = get_database()
+    return await db.users.find_one({"_id": user_id}, projection=USER_PUBLIC_PROJECTION)
 
 async def get_user_by_email(email: str):
     """
@@ -78,14 +183,36 @@ async def authenticate_user(username: str, password: str):
     Аутентификация пользователя
     """
     user = await get_user_by_username(username)
-    if not user or not verify_password(password, user["hashed_password"]):
+    if not user:
+        return False
+    if not await run_in_threadpool(verify_password, password, user["hashed_password"]):
         return False
+    
+    # Пароль известен только в момент входа, поэтому хеш обновляется здесь
+    if password_needs_rehash(user["hashed_password"]):
+        hashed_password = await run_in_threadpool(get_password_hash, password)
+        db = get_database()
+        await db.users.update_one(
+            {"_id": user["_id"]},
+            {"$set": {"hashed_password": hashed_password}}
+        )
+        user["hashed_password"] = hashed_password
     return user
 
 async def get_current_user(token: str = Depends(oauth2_scheme)):
     """
     Получение текущего пользователя из токена
     """
+    # Повторная проверка подписи не нужна, пока токен не истек
+    token_key = hashlib.blake2b(token.encode("utf-8"), digest_size=16).digest()
+    cached = _verified_tokens.get(token_key)
+    if cached is not None:
+        cached_user, expires_at = cached
+        if time.time() < expires_at:
+            _verified_tokens.move_to_end(token_key)
+            return cached_user
+        del _verified_tokens[token_key]
+    
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Неверные учетные данные",
@@ -93,16 +220,38 @@ async def get_current_user(token: str = Depends(oauth2_scheme)):
     )
     
     try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+        payload = jwt.decode(token, settings.SECRET_KEY, algorithms=[settings.ALGORITHM])
         username: str = payload.get("sub")
         if username is None:
             raise credentials_exception
     except jwt.PyJWTError:
         raise credentials_exception
-        
-    user = await get_user_by_username(username)
-    if user is None:
-        raise credentials_exception
+    
+    if all(claim in payload for claim in ("uid", "act", "adm", "prem")):
+        # Пользователь восстанавливается из токена без обращения к БД;
+        # изменения учетной записи вступают в силу с новым токеном
+        try:
+            user_id = ObjectId(payload["uid"])
+        except InvalidId:
+            raise credentials_exception
+        user = {
+            "_id": user_id,
+            "username": username,
+            "is_active": payload["act"],
+            "is_admin": payload["adm"],
+            "is_premium": payload["prem"]
+        }
+        # Кэшируются только успешно проверенные токены, пользователь которых
+        # целиком восстанавливается из токена
+        if user["is_active"]:
+            _verified_tokens[token_key] = (user, payload["exp"])
+            while len(_verified_tokens) > settings.TOKEN_CACHE_SIZE:
+                _verified_tokens.popitem(last=False)
+    else:
+        # Токены, выданные до появления этих полей
+        user = await get_user_by_username(username)
+        if user is None:
+            raise credentials_exception
     
     if not user["is_active"]:
         raise HTTPException(
@@ -121,13 +270,31 @@ async def get_current_active_user(current_user: Dict[str, Any] = Depends(get_cur
         raise HTTPException(status_code=400, detail="Неактивный пользователь")
     return current_user
 
-async def get_current_admin(current_user: Dict[str, Any] = Depends(get_current_user)):
+async def get_current_user_document(current_user: Dict[str, Any] = Depends(get_current_active_user)):
     """
-    Проверка прав администратора
+    Полный документ текущего пользователя из БД (для эндпоинтов,
+    которым нужны поля, отсутствующие в токене)
     """
-    if not current_user.get("is_admin", False):
+    user = await get_user_public(current_user["_id"])
+    if user is None or not user["is_active"]:
         raise HTTPException(
-            status_code=status.HTTP_403_FORBIDDEN,
-            detail="Доступ запрещен. Требуются права администратора",
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Неверные учетные данные",
+            headers={"WWW-Authenticate": "Bearer"},
         )
-    return current_user
\ No newline at end of file
+    return user
+
+async def get_current_admin(current_user: Dict[str, Any] = Depends(get_current_user)):
+    """
+    Проверка прав администратора.
+    Права перепроверяются по БД, чтобы их отзыв действовал сразу, а не
+    после истечения токена.
+    """
+    if current_user.get("is_admin", False):
+        user = await get_user_public(current_user["_id"])
+        if user is not None and user["is_active"] and user.get("is_admin", False):
+            return user
+    raise HTTPException(
+        status_code=status.HTTP_403_FORBIDDEN,
+        detail="Доступ запрещен. Требуются права администратора",
+    )
\ No newline at end of file
@@ -0,0 +1,23 @@
+"""
+Общие фикстуры тестов
+"""
+import os
+
+# Настройки читаются при импорте app.config
+os.environ.setdefault("SECRET_KEY", "test-secret-key")
+os.environ.setdefault("MONGODB_URL", "mongodb://localhost:27017")
+
+import pytest
+from mongomock_motor import AsyncMongoMockClient
+
+import app.database as database
+
+@pytest.fixture
+def db(monkeypatch):
+    """
+    База данных в памяти вместо MongoDB (Redis не используется)
+    """
+    mock_db = AsyncMongoMockClient()["ocr_test_db"]
+    monkeypatch.setattr(database, "db", mock_db)
+    monkeypatch.setattr(database, "redis_client", None)
+    return mock_db
@@ -0,0 +1,30 @@
+"""
+Тесты сервиса авторизации
+"""
+import pytest
+from pymongo.errors import OperationFailure
+
+from app.services.auth import migrate_refresh_tokens
+from app.utils.security import hash_refresh_token
+
+@pytest.mark.asyncio
+async def test_migrate_refresh_tokens_tolerates_concurrent_index_drop(db, monkeypatch):
+    await db.refresh_tokens.create_index("token", unique=True)
+    await db.refresh_tokens.insert_one({"token": "legacy-token"})
+    
+    # Индекс уже удален другим процессом после проверки index_information
+    async def drop_index(*args, **kwargs):
+        raise OperationFailure("index not found with name [token_1]", code=27)
+    monkeypatch.setattr(type(db.refresh_tokens), "drop_index", drop_index)
+    
+    await migrate_refresh_tokens()
+    
+    migrated = await db.refresh_tokens.find_one({})
+    assert "token" not in migrated
+    assert migrated["token_hash"] == hash_refresh_token("legacy-token")
+
+@pytest.mark.asyncio
+async def test_migrate_refresh_tokens_without_legacy_index(db):
+    # Повторный запуск после миграции
+    await migrate_refresh_tokens()
+    await migrate_refresh_tokens()
@@ -0,0 +1,38 @@
+"""
+Тесты утилит обработки изображений
+"""
+import numpy as np
+import torch
+
+from app.utils.image import _AutocastRecognizer, preprocess_image, shutdown_ocr_pool, start_ocr_executor
+
+def test_autocast_recognizer_returns_float32():
+    # EasyOCR вызывает .numpy() на выходе распознавателя, а numpy
+    # не поддерживает bfloat16
+    model = _AutocastRecognizer(torch.nn.Linear(4, 3), torch.bfloat16)
+    output = model(torch.randn(2, 4))
+    assert output.dtype == torch.float32
+    assert output.detach().numpy().shape == (2, 3)
+
+def test_preprocess_image_skips_clean_images():
+    # Контрастное и резкое изображение (случайный шум) не изменяется
+    noise = np.random.default_rng(0).integers(0, 256, (64, 64), dtype=np.uint8)
+    assert preprocess_image(noise) is noise
+
+def test_preprocess_image_stretches_low_contrast():
+    flat = np.full((64, 64), 120, dtype=np.uint8)
+    flat[16:48, 16:48] = 130
+    result = preprocess_image(flat)
+    assert result.shape == flat.shape
+    assert result.dtype == np.uint8
+    assert result.min() == 0 and result.max() == 255
+
+def test_ocr_executor_recreated_after_shutdown():
+    # Повторный запуск приложения в том же процессе (TestClient, --reload)
+    start_ocr_executor()
+    shutdown_ocr_pool()
+    executor = start_ocr_executor()
+    try:
+        assert executor.submit(sum, [1, 2]).result() == 3
+    finally:
+        shutdown_ocr_pool()
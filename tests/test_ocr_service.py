@@ -0,0 +1,63 @@
+"""
+Тесты сервиса OCR: сохранение запросов и счетчики
+"""
+from datetime import datetime
+
+import pytest
+from bson import ObjectId
+
+from app.services import ocr_writer
+from app.services.ocr import save_ocr_request
+from app.services.user import admin_delete_user
+
+@pytest.mark.asyncio
+async def test_save_ocr_request_updates_counters(db):
+    user_id = ObjectId()
+    await db.users.insert_one({"_id": user_id, "username": "user"})
+    
+    ocr_writer.start_ocr_writer()
+    try:
+        await save_ocr_request(str(user_id), "ru", True, False, "текст")
+    finally:
+        await ocr_writer.stop_ocr_writer()
+    
+    today = datetime.utcnow().strftime("%Y-%m-%d")
+    
+    # Запрос записан фоновой задачей
+    saved = await db.ocr_requests.find_one({"user_id": user_id})
+    assert saved["language"] == "ru"
+    assert saved["result_text"] == "текст"
+    
+    # Общий счетчик пользователя (дневной учитывается при резервировании)
+    user = await db.users.find_one({"_id": user_id})
+    assert user["request_count"] == 1
+    
+    # Счетчики статистики по языку и по дню
+    language_counter = await db.ocr_stats_counters.find_one({"_id": "l:ru"})
+    day_counter = await db.ocr_stats_counters.find_one({"_id": f"d:{today}"})
+    assert language_counter["count"] == 1
+    assert day_counter["count"] == 1
+    assert day_counter["date"] == datetime.strptime(today, "%Y-%m-%d")
+
+@pytest.mark.asyncio
+async def test_admin_delete_user_subtracts_stats_counters(db):
+    admin_id, user_id, other_id = ObjectId(), ObjectId(), ObjectId()
+    await db.users.insert_many([{"_id": user_id}, {"_id": other_id}])
+    
+    ocr_writer.start_ocr_writer()
+    try:
+        await save_ocr_request(str(user_id), "ru", False, False, "a")
+        await save_ocr_request(str(user_id), "en", False, False, "b")
+        await save_ocr_request(str(other_id), "ru", False, False, "c")
+    finally:
+        await ocr_writer.stop_ocr_writer()
+    
+    await admin_delete_user(str(user_id), str(admin_id))
+    
+    today = datetime.utcnow().strftime("%Y-%m-%d")
+    counters = {
+        doc["_id"]: doc["count"]
+        async for doc in db.ocr_stats_counters.find()
+    }
+    assert counters == {"l:ru": 1, f"d:{today}": 1}
+    assert await db.ocr_requests.count_documents({}) == 1
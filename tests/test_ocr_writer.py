@@ -0,0 +1,60 @@
+"""
+Тесты буферизованной записи запросов OCR
+"""
+from datetime import datetime
+
+import pytest
+from bson import ObjectId
+
+from app.services import ocr_writer
+from app.services.ocr import save_ocr_request
+from app.services.user import admin_delete_user
+
+@pytest.mark.asyncio
+async def test_delete_user_waits_for_buffered_requests(db):
+    user_id = ObjectId()
+    await db.users.insert_one({"_id": user_id})
+    
+    ocr_writer.start_ocr_writer()
+    try:
+        # Запрос еще в буфере в момент удаления пользователя
+        await save_ocr_request(str(user_id), "ru", False, False, "a")
+        await admin_delete_user(str(user_id), str(ObjectId()))
+    finally:
+        await ocr_writer.stop_ocr_writer()
+    
+    assert await db.ocr_requests.count_documents({}) == 0
+    assert await db.ocr_stats_counters.count_documents({}) == 0
+
+@pytest.mark.asyncio
+async def test_failed_insert_does_not_update_counters(db, monkeypatch):
+    user_id = ObjectId()
+    await db.users.insert_one({"_id": user_id})
+    
+    async def failing_insert_many(*args, **kwargs):
+        raise ConnectionError("MongoDB недоступна")
+    monkeypatch.setattr(type(db.ocr_requests), "insert_many", failing_insert_many)
+    
+    ocr_writer.start_ocr_writer()
+    try:
+        await save_ocr_request(str(user_id), "ru", False, False, "a")
+    finally:
+        await ocr_writer.stop_ocr_writer()
+    
+    assert await db.ocr_stats_counters.count_documents({}) == 0
+    user = await db.users.find_one({"_id": user_id})
+    assert "request_count" not in user
+
+@pytest.mark.asyncio
+async def test_request_saved_after_writer_stopped(db):
+    user_id = ObjectId()
+    await db.users.insert_one({"_id": user_id})
+    
+    # Фоновая запись не запущена (или уже остановлена)
+    await save_ocr_request(str(user_id), "en", False, False, "b")
+    
+    assert await db.ocr_requests.count_documents({"user_id": user_id}) == 1
+    user = await db.users.find_one({"_id": user_id})
+    assert user["request_count"] == 1
+    today = datetime.utcnow().strftime("%Y-%m-%d")
+    assert (await db.ocr_stats_counters.find_one({"_id": f"d:{today}"}))["count"] == 1
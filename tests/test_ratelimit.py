@@ -0,0 +1,76 @@
+"""
+Тесты дневного лимита запросов
+"""
+import asyncio
+
+import pytest
+import pytest_asyncio
+from bson import ObjectId
+from fakeredis import aioredis as fake_aioredis
+from fastapi import HTTPException
+
+import app.database as database
+from app.dependencies import check_access
+from app.models.admin import SystemSettings
+from app.services.ocr import check_user_request_limit
+
+REQUEST_LIMIT = 10
+
+@pytest.fixture
+def redis(db, monkeypatch):
+    client = fake_aioredis.FakeRedis()
+    monkeypatch.setattr(database, "redis_client", client)
+    return client
+
+@pytest_asyncio.fixture
+async def user(db):
+    user = {"_id": ObjectId(), "is_premium": False}
+    await db.users.insert_one(dict(user))
+    return user
+
+def _system_settings() -> SystemSettings:
+    return SystemSettings(
+        request_limit=REQUEST_LIMIT,
+        default_language="ru+en",
+        preprocess_by_default=True,
+        admin_email="admin@example.com",
+        maintenance_mode=False,
+        max_file_size=5
+    )
+
+async def _reserve_concurrently(user, count: int) -> int:
+    """
+    Одновременное резервирование count запросов, результат - число успешных
+    """
+    results = await asyncio.gather(
+        *[check_user_request_limit(user, REQUEST_LIMIT) for _ in range(count)],
+        return_exceptions=True
+    )
+    for result in results:
+        if isinstance(result, Exception):
+            assert isinstance(result, HTTPException) and result.status_code == 429
+    return sum(not isinstance(result, Exception) for result in results)
+
+@pytest.mark.asyncio
+async def test_concurrent_requests_do_not_exceed_limit_redis(redis, user):
+    assert await _reserve_concurrently(user, 30) == REQUEST_LIMIT
+
+@pytest.mark.asyncio
+async def test_concurrent_requests_do_not_exceed_limit_mongodb(db, user):
+    assert await _reserve_concurrently(user, 30) == REQUEST_LIMIT
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("use_redis", [True, False])
+async def test_failed_request_returns_reservation(request, user, use_redis):
+    if use_redis:
+        request.getfixturevalue("redis")
+    
+    # Все запросы завершаются ошибкой (например, неподдерживаемый формат)
+    for _ in range(REQUEST_LIMIT + 5):
+        access = check_access(user, _system_settings())
+        await access.__anext__()
+        with pytest.raises(HTTPException):
+            await access.athrow(HTTPException(status_code=400))
+    
+    # Лимит не израсходован
+    assert await _reserve_concurrently(user, REQUEST_LIMIT) == REQUEST_LIMIT